@@ -0,0 +1,157 @@
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a model call cannot be admitted
+
+    status is the HTTP status to answer with: 429 when the queue is full,
+    503 when the caller waited in the queue past its deadline.
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded wait queue in front of model calls
+
+    At most max_concurrent calls run at once. Up to max_queue more may wait
+    for a slot, each for at most queue_timeout seconds; anything beyond that
+    is turned away immediately so callers can back off instead of piling
+    onto the upstream API.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=32, queue_timeout=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._service_time = 1.0  # moving average of call duration in seconds
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def retry_after(self):
+        """Seconds a rejected caller should wait, from the queue depth and call duration"""
+        backlog = (self._waiting + 1) / max(1, self.max_concurrent)
+        return max(1, math.ceil(backlog * self._service_time))
+
+    def acquire(self):
+        with self._cond:
+            if self._active >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise Overloaded("Too many questions right now, please try again shortly", 429, self.retry_after())
+
+                deadline = time.monotonic() + self.queue_timeout
+                self._waiting += 1
+                try:
+                    while self._active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            raise Overloaded("The model is busy, please try again shortly", 503, self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._active += 1
+            self.admitted += 1
+        return time.monotonic()
+
+    def release(self, started):
+        with self._cond:
+            self._active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of a with block"""
+        started = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def stream(self, chunks_fn):
+        """Hold a slot while the iterator returned by chunks_fn is consumed"""
+        with self.slot():
+            yield from chunks_fn()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'service_time': round(self._service_time, 3),
+            }
+
+
+class AsyncAdmissionController(AdmissionController):
+    """The same limits for coroutines on one event loop
+
+    Queued callers await a slot instead of blocking a thread each, so a
+    full queue costs no threads. Only call it from the loop it was first
+    used on; stats may still be read from any thread.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=32, queue_timeout=10.0):
+        super().__init__(max_concurrent, max_queue, queue_timeout)
+        self._available = None  # created on first use, inside the running loop
+
+    async def acquire(self):
+        if self._available is None:
+            self._available = asyncio.Condition()
+        async with self._available:
+            if self._active >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise Overloaded("Too many questions right now, please try again shortly", 429, self.retry_after())
+
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._available.wait_for(lambda: self._active < self.max_concurrent),
+                        self.queue_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.timed_out += 1
+                    raise Overloaded("The model is busy, please try again shortly", 503, self.retry_after())
+                finally:
+                    self._waiting -= 1
+
+            self._active += 1
+            self.admitted += 1
+        return time.monotonic()
+
+    async def release(self, started):
+        async with self._available:
+            self._active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._available.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        started = await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release(started)
+
+    async def stream(self, chunks_fn):
+        """Hold a slot while the async iterator returned by chunks_fn is consumed"""
+        async with self.slot():
+            async for chunk in chunks_fn():
+                yield chunk
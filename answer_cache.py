@@ -0,0 +1,93 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_question(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = ' '.join(text.lower().split())
+    return re.sub(r'[\s?!.]+$', '', text)
+
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """Bounded LRU cache of model answers with a per-entry TTL
+
+    Keys come from make_key so that an answer is only reused for the same
+    question asked with the same recent conversation and file content.
+    """
+
+    def __init__(self, max_entries=1000, ttl=60 * 60, history_turns=2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self._entries = OrderedDict()  # key -> (expires_at, answer)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def context_digest(self, history, user_context=''):
+        """Digest of the conversation state an answer depends on
+
+        Only the last history_turns turns of history count. A first answer
+        greets the user by name, so for an empty history the user_context
+        (name and age) is hashed instead.
+        """
+        recent = history[-2 * self.history_turns:] if self.history_turns else []
+        if recent:
+            return digest('\x1e'.join(
+                f"{message['role']}:{''.join(message['parts'])}" for message in recent
+            ))
+        return digest('first:' + user_context)
+
+    def make_key(self, user_input, history, file_content='', user_context=''):
+        """Build the cache key for a question asked with this history and file content"""
+        file_digest = digest(file_content) if file_content else ''
+        return digest('\x1f'.join((
+            normalize_question(user_input),
+            self.context_digest(history, user_context),
+            file_digest,
+        )))
+
+    def get(self, key):
+        """Return the cached answer for key, or None"""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, answer):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -1,51 +1,47 @@
 import os
 from flask import Flask, request, render_template, jsonify, session, send_from_directory, make_response, Response
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-try:
-    import PyPDF2
-    from docx import Document
-except ImportError:
-    print("Warning: PyPDF2 or python-docx not installed. PDF/DOC support will be limited to text files only.")
-    # Provide fallback for file reading
-    PyPDF2 = None
-    Document = None
 import re
+import json
+import uuid
+import tempfile
+import threading
+import time
 import requests
 from urllib.parse import quote
 from dotenv import load_dotenv
 from flask_session import Session
-from io import BytesIO
-
-# Global storage for uploaded files
-UPLOAD_STORAGE = {}
+from conversation_store import ConversationStore
+from backends import create_backend
+from answer_cache import AnswerCache
+from compaction import HistoryCompactor
+from context_budget import TokenEstimator, ContextBudgeter
+from singleflight import SingleFlight
+from admission import AdmissionController, Overloaded
+from extraction_pool import ExtractionPool, ExtractionTimeout
+from upload_storage import UploadStorage
+from document_store import DocumentStore, default_spill_dir
+from upload_spool import SpoolingRequest, UploadSpool, kind_matches, sniff_file
+from chunked_upload import ChunkedUploadError, ChunkedUploads
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import RequestEntityTooLarge
+from retrieval import BM25Index, CorpusIndex, chunk_document, reciprocal_rank_fusion
+from documents import PdfDocument, file_extension
+from page_loader import PageLoader
+from intent import IntentClassifier
+from prompts import PromptBuilder
+from context_cache import ContextCacheRegistry
 
 # Set up the Flask app
 app = Flask(__name__)
+# Uploaded files are streamed to disk as they arrive instead of into memory
+app.request_class = SpoolingRequest
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-dev-secret-key')
 
-# Configure the Gemini API with error handling
-try:
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-except Exception as e:
-    print(f"Error configuring Gemini API: {str(e)}")
-
 # Enable debug mode
 app.debug = True
 
-# Generation config for the model
-generation_config = {
-    "temperature": 1,
-    "top_p": 0.95,
-    "top_k": 64,
-    "max_output_tokens": 8192,
-    "response_mime_type": "text/plain",
-}
-
-model = genai.GenerativeModel(
-    model_name="gemini-1.5-flash",
-    generation_config=generation_config,
-    system_instruction="""You are a senior computer science student and a mentor. Format your responses in a clean, readable way:
+SYSTEM_INSTRUCTION = """You are a senior computer science student and a mentor. Format your responses in a clean, readable way:
 
 1. Use clear headings without ## symbols
 2. Use bullet points for lists (without showing the - symbol)
@@ -55,9 +51,81 @@ model = genai.GenerativeModel(
 6. Use natural language for emphasis instead of markdown symbols
 
 At the start of first response, greet the user by name (but only once). Your role is to engage in friendly, curriculum-focused conversations and answer questions in a concise, approachable way. For basic and simple questions, aim to respond with one or two words, but don't be static - add a bit of humor in between the conversation. When explaining concepts, focus only on the essentials, making them easy to understand with relatable analogies and examples."""
+
+# Chat model backend, Gemini unless CHATBOT_BACKEND says otherwise
+backend = create_backend(SYSTEM_INSTRUCTION)
+
+# Chat history per browser session, bounded per session and overall
+conversations = ConversationStore(
+    max_turns=int(os.getenv('CONVERSATION_MAX_TURNS', '50')),
+    idle_timeout=int(os.getenv('CONVERSATION_IDLE_SECONDS', '1800')),
+    max_total_chars=int(os.getenv('CONVERSATION_MAX_CHARS', '20000000')),
+)
+
+# Prompt token budget shared by system prompt, history, file content and question
+token_estimator = TokenEstimator(backend, use_backend=os.getenv('EXACT_TOKEN_COUNTS', '0') == '1')
+context_budgeter = ContextBudgeter(
+    token_estimator,
+    max_tokens=int(os.getenv('CONTEXT_TOKEN_BUDGET', '8000')),
+    history_share=float(os.getenv('CONTEXT_HISTORY_SHARE', '0.25')),
+    system_prompt=SYSTEM_INSTRUCTION,
+)
+
+# Limit concurrent model calls and turn away requests once the queue is full
+admission = AdmissionController(
+    max_concurrent=int(os.getenv('MODEL_MAX_CONCURRENCY', '8')),
+    max_queue=int(os.getenv('MODEL_QUEUE_SIZE', '32')),
+    queue_timeout=float(os.getenv('MODEL_QUEUE_TIMEOUT', '10')),
+)
+
+# Old turns of long conversations are summarized in the background, within the same limits
+compactor = HistoryCompactor(
+    conversations,
+    backend,
+    admission=admission,
+    token_budget=int(os.getenv('HISTORY_TOKEN_BUDGET', '8000')),
+    keep_turns=int(os.getenv('HISTORY_KEEP_TURNS', '6')),
+)
+
+# Answers to repeated questions, keyed on question, recent history and file content
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv('ANSWER_CACHE_SIZE', '1000')),
+    ttl=int(os.getenv('ANSWER_CACHE_TTL', '3600')),
+    history_turns=int(os.getenv('ANSWER_CACHE_HISTORY_TURNS', '2')),
+)
+
+# Optional cache that also answers paraphrases of earlier questions
+semantic_cache = None
+if os.getenv('SEMANTIC_CACHE_ENABLED', '0') == '1':
+    from semantic_cache import SemanticCache
+    semantic_cache = SemanticCache(
+        threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9')),
+        max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', '5000')),
+        max_bytes=int(os.getenv('SEMANTIC_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+    )
+
+# Prompts are assembled from f-string functions and a cached per-session header
+prompt_builder = PromptBuilder()
+
+# Decides per question whether the uploaded documents are worth their prompt tokens
+intent_classifier = IntentClassifier.train(
+    threshold=float(os.getenv('INTENT_THRESHOLD', '0.6')),
+    similarity_weight=float(os.getenv('INTENT_SIMILARITY_WEIGHT', '0.9')),
 )
 
-history = []
+# Large documents are cached on the backend once and referenced by later questions
+context_cache = None
+if os.getenv('CONTEXT_CACHE_ENABLED', '0') == '1':
+    context_cache = ContextCacheRegistry(
+        backend,
+        token_estimator.count,
+        # Kept as long as an idle session is
+        ttl=int(os.getenv('CONTEXT_CACHE_TTL', os.getenv('CONVERSATION_IDLE_SECONDS', '1800'))),
+        min_tokens=int(os.getenv('CONTEXT_CACHE_MIN_TOKENS', '32768')),
+    )
+
+# Identical questions asked at the same time wait on one model call
+inflight = SingleFlight()
 
 if os.getenv('FLASK_ENV') == 'production':
     UPLOAD_FOLDER = None
@@ -68,41 +136,92 @@ else:
 
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
 
+def upload_entry_size(entry):
+    size = entry['document'].nbytes + entry['index'].nbytes
+    if entry.get('vectors') is not None:
+        size += entry['vectors'].nbytes
+    return size
+
+# Large uploads are spilled to disk and read back through mmap
+document_store = DocumentStore(
+    os.getenv('DOCUMENT_CACHE_DIR') or default_spill_dir(UPLOAD_FOLDER),
+    spill_threshold=int(os.getenv('SPILL_THRESHOLD_KB', '1024')) * 1024,
+)
+
+def remove_upload_entry(file_key, entry):
+    if entry.get('loader') is not None:
+        entry['loader'].cancel()
+    if entry.get('spill_dir'):
+        document_store.remove(entry['spill_dir'])
+    if context_cache is not None:
+        context_cache.forget(file_key)
+
+# Global storage for uploaded files, bounded by memory and idle time
+UPLOAD_STORAGE = UploadStorage(
+    max_bytes=int(os.getenv('UPLOAD_STORAGE_MB', '256')) * 1024 * 1024,
+    ttl=int(os.getenv('UPLOAD_TTL_SECONDS', '3600')),
+    sizeof=upload_entry_size,
+    on_remove=remove_upload_entry,
+)
+
+# Uploads of the same file at the same time are parsed once
+upload_inflight = SingleFlight()
+
+# Resumable uploads arrive in chunks small enough for serverless request limits
+chunked_uploads = ChunkedUploads(
+    os.path.join(document_store.directory, 'chunked'),
+    chunk_size=int(os.getenv('UPLOAD_CHUNK_KB', '4096')) * 1024,
+    max_size=int(os.getenv('MAX_UPLOAD_MB', '50')) * 1024 * 1024,
+    ttl=int(os.getenv('CHUNKED_UPLOAD_TTL', str(24 * 60 * 60))),
+)
+# Finalized chunked uploads are parsed here while the client moves on
+finalize_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-finalize')
+# upload id -> (Future of its finalize_upload, when it was submitted); the future's result is the content hash
+finalize_jobs = {}
+finalize_jobs_lock = threading.Lock()
+
+# PDF and DOCX parsing runs in worker processes with per-file limits
+extraction_pool = ExtractionPool(
+    max_workers=int(os.getenv('EXTRACTION_WORKERS', '2')),
+    timeout=float(os.getenv('EXTRACTION_TIMEOUT', '30')),
+    memory_limit=int(os.getenv('EXTRACTION_MEMORY_MB', '512')) * 1024 * 1024,
+)
+
+# Uploaded documents are split into overlapping passages for retrieval
+PASSAGE_CHARS = int(os.getenv('PASSAGE_CHARS', '1000'))
+PASSAGE_OVERLAP = int(os.getenv('PASSAGE_OVERLAP', '150'))
+# PDFs are read this many pages at a time; the upload returns after the first batch
+PDF_BATCH_PAGES = int(os.getenv('PDF_BATCH_PAGES', '16'))
+# A session can ask about this many uploaded files at once
+MAX_SESSION_DOCUMENTS = int(os.getenv('MAX_SESSION_DOCUMENTS', '5'))
+PAGE_REFERENCE = re.compile(r'\bpages?\s+(\d+)(?:\s*(?:-|to)\s*(\d+))?', re.IGNORECASE)
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '8'))
+
+# 'bm25' keyword search, 'dense' vector search or 'hybrid' to fuse both
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'bm25')
+INDEX_CACHE_DIR = os.getenv('INDEX_CACHE_DIR', os.path.join(UPLOAD_FOLDER or tempfile.gettempdir(), 'index_cache'))
+passage_embedder = None
+if RETRIEVAL_MODE in ('dense', 'hybrid'):
+    from embeddings import HashingEmbedder
+    from vector_index import VectorIndex
+    passage_embedder = HashingEmbedder(dim=int(os.getenv('EMBEDDING_DIM', '512')))
+    QUANTIZE_VECTORS = os.getenv('QUANTIZE_VECTORS', '0') == '1'
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Spool next to the document cache so spilled uploads are moved, not copied
+app.config['SPOOL_FOLDER'] = os.path.join(document_store.directory, 'spool')
+# Requests larger than this are rejected before (or while) the body is read
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', '50')) * 1024 * 1024
 app.config['SESSION_TYPE'] = 'null'
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def read_file_content(file_data, filename):
-    """Read content from different file types stored in memory"""
-    file_extension = filename.lower().split('.')[-1]
-    
-    try:
-        if file_extension == 'txt':
-            return file_data.decode('utf-8')
-                
-        elif file_extension == 'pdf':
-            if PyPDF2 is None:
-                return "PDF support not available. Please install PyPDF2."
-            content = []
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_data))
-            for page in pdf_reader.pages:
-                content.append(page.extract_text())
-            return '\n'.join(content)
-            
-        elif file_extension in ['doc', 'docx']:
-            if Document is None:
-                return "DOC/DOCX support not available. Please install python-docx."
-            doc = Document(BytesIO(file_data))
-            return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-            
-        else:
-            return "Unsupported file format"
-            
-    except Exception as e:
-        print(f"Error reading file {filename}: {str(e)}")
-        return f"Error reading file: {str(e)}"
+def get_conversation_id():
+    """Return the id of the current session's conversation, creating one if needed"""
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
+    return session['conversation_id']
 
 @app.route('/')
 def index():
@@ -127,14 +246,15 @@ def save_user_info():
         session['user_age'] = age
         
         # Clear previous user's history and file content
-        global history
-        history = []
-        if 'uploaded_file' in session:
-            # Delete the previous file if it exists
-            old_filepath = session['uploaded_file']
-            if os.path.exists(old_filepath):
-                os.remove(old_filepath)
-            session.pop('uploaded_file')
+        old_conversation_id = session.get('conversation_id')
+        if old_conversation_id:
+            conversations.reset(old_conversation_id)
+            prompt_builder.forget(old_conversation_id)
+        session['conversation_id'] = uuid.uuid4().hex
+        resolve_finalized_uploads()
+        for file_key, filename in session.pop('uploaded_files', []):
+            # Release the previous user's files; each is freed once no session uses it
+            release_session_document(file_key, old_conversation_id)
         
         return jsonify({'status': 'success'})
         
@@ -142,67 +262,335 @@ def save_user_info():
         print(f"Error in save_user_info: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def build_context_message(user_input, history):
+    """Build the prompt sent to the model for a question from the current session
+
+    Returns the prompt, the file content that was injected into it, the
+    number of oldest history turns to leave out so the request fits the
+    token budget and the cached context (or None) the prompt refers to.
+    """
+    # The user's header is rendered once per session
+    prefix = prompt_builder.prefix(
+        get_conversation_id(), session.get('user_name', 'User'), session.get('user_age', 'Unknown')
+    )
+    
+    # Get the relevant passages of the uploaded files only if the question needs them
+    passages = []
+    cached_document, cached = None, None
+    documents = session_documents() if session.get('uploaded_files') else []
+    if documents:
+        # Text was extracted and indexed once at upload time
+        corpus = CorpusIndex((document.position, document.entry['index']) for document in documents)
+        pages = referenced_pages(user_input)
+        if pages or intent_classifier.wants_document(user_input, corpus):
+            passages = relevant_passages(documents, user_input, pages, corpus)
+            # The model reads a cached document whole, so only other files need excerpts
+            cached_document, cached = cached_context(documents)
+            if cached is not None:
+                passages = [item for item in passages if item[0] is not cached_document]
+    cached_name = cached_document.filename if cached is not None else None
+
+    # Fit history and file content into the token budget; the question is never cut.
+    # A cached document is not part of the prompt, so it takes none of the budget.
+    file_content = ""
+    if passages:
+        # Keep as many of the best passages as fit, then restore document order
+        excerpts = [format_passage(document, passage) for document, passage in passages]
+        plan = context_budgeter.plan(prompt_builder.frame(prefix, user_input, cached_name), history, passages=excerpts)
+        chosen = sorted(plan.passages, key=lambda index: passage_order(passages[index]))
+        file_content = '\n\n'.join(excerpts[index] for index in chosen)
+    else:
+        plan = context_budgeter.plan(prompt_builder.build(prefix, user_input, cached_document=cached_name), history)
+
+    context_message = prompt_builder.build(prefix, user_input, file_content, cached_name)
+    if cached is not None:
+        # Cached answers depend on the cached document as well as the excerpts
+        file_content = f"[cached {cached_document.file_key}]\n{file_content}"
+    return context_message, file_content, plan.skip_turns, cached
+
+def cached_context(documents):
+    """The session's largest fully read document and its context cache handle
+
+    Returns (None, None) if context caching is off or the document is too
+    small to cache.
+    """
+    if context_cache is None or not context_cache.enabled:
+        return None, None
+    # PDFs still being read are cached once they are complete
+    complete = [document for document in documents if getattr(document.entry['document'], 'complete', True)]
+    if not complete:
+        return None, None
+    document = max(complete, key=lambda document: document.entry['index'].total_length)
+    cached = context_cache.get(
+        document.file_key,
+        lambda: cacheable_text(document.entry['document']),
+        display_name=document.filename,
+    )
+    return (document, cached) if cached is not None else (None, None)
+
+def cacheable_text(document):
+    """A document's full text with each page or paragraph numbered, so answers can cite them"""
+    text = document.text
+    if document.segment_kind not in ('page', 'paragraph'):
+        return text
+    label = document.segment_kind.capitalize()
+    offsets = document.offsets
+    ends = offsets[1:] + [len(text)]
+    return '\n\n'.join(
+        f"[{label} {number}]\n{text[start:end].strip()}"
+        for number, (start, end) in enumerate(zip(offsets, ends), 1)
+    )
+
+def referenced_pages(user_input):
+    """Page indices named in a question, e.g. "page 12" or "pages 3-5" (at most 10)"""
+    pages = []
+    for match in PAGE_REFERENCE.finditer(user_input):
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        pages.extend(range(first - 1, min(last, first + 9)))
+    return pages[:10]
+
+class SessionDocument:
+    """An uploaded file as one session sees it: its shared entry and the name it was uploaded as"""
+
+    def __init__(self, position, file_key, filename, entry):
+        self.position = position  # upload order within the session
+        self.file_key = file_key
+        self.filename = filename
+        self.entry = entry
+
+    @property
+    def segment_kind(self):
+        return self.entry['document'].segment_kind
+
+def session_documents():
+    """The session's uploaded files that are still stored, in upload order"""
+    resolve_finalized_uploads()
+    documents = []
+    for position, (file_key, filename) in enumerate(session.get('uploaded_files', [])):
+        entry = UPLOAD_STORAGE.get(file_key)
+        if entry is not None:
+            documents.append(SessionDocument(position, file_key, filename, entry))
+    return documents
+
+def relevant_passages(documents, user_input, pages=(), corpus=None):
+    """Return the (document, passage) pairs that best match the question, best first
+
+    The session's documents are searched as one corpus. Passages from pages
+    the question names come first; a PDF that is still being read has
+    those pages read right away.
+    """
+    named = []
+    if pages:
+        wanted = set(pages)
+        for document in documents:
+            if document.segment_kind != 'page':
+                continue
+            if document.entry.get('loader') is not None:
+                document.entry['loader'].ensure(pages)
+            named.extend(
+                (document, passage) for passage in list(document.entry['index'].passages) if passage.segment in wanted
+            )
+        named = named[:RETRIEVAL_TOP_K]
+
+    # Rows are (document position, passage index) across every document
+    rankings = []
+    if RETRIEVAL_MODE in ('bm25', 'hybrid'):
+        if corpus is None:
+            corpus = CorpusIndex((document.position, document.entry['index']) for document in documents)
+        rankings.append([row for score, row in corpus.rank(user_input, k=RETRIEVAL_TOP_K)])
+    if passage_embedder is not None:
+        query_vector = passage_embedder.embed(user_input)
+        # Vectors are normalized, so scores from different documents compare directly
+        scored = [
+            (score, (document.position, row))
+            for document in documents if document.entry.get('vectors') is not None
+            for score, row in document.entry['vectors'].search(query_vector, k=RETRIEVAL_TOP_K)
+        ]
+        rankings.append([row for score, row in sorted(scored, key=lambda item: item[0], reverse=True)[:RETRIEVAL_TOP_K]])
+
+    by_position = {document.position: document for document in documents}
+    rows = reciprocal_rank_fusion(rankings)[:RETRIEVAL_TOP_K]
+    if rows or named:
+        ranked = [(by_position[position], by_position[position].entry['index'].passages[row]) for position, row in rows]
+        seen = {id(passage) for document, passage in named}
+        return named + [item for item in ranked if id(item[1]) not in seen]
+    # Nothing matched (e.g. "summarize the document"), so start from the beginning of each
+    share = max(1, RETRIEVAL_TOP_K * 4 // len(documents))
+    return [(document, passage) for document in documents for passage in document.entry['index'].passages[:share]]
+
+def passage_order(item):
+    document, passage = item
+    return (document.position, passage.segment, passage.start)
+
+def format_passage(document, passage):
+    """An excerpt for the prompt, citing the document (and page or paragraph) it came from"""
+    if document.segment_kind == 'page':
+        return f"[{document.filename}, page {passage.segment + 1}] {passage.text}"
+    if document.segment_kind == 'paragraph':
+        return f"[{document.filename}, paragraph {passage.segment + 1}] {passage.text}"
+    return f"[{document.filename}] {passage.text}"
+
+def lookup_cached_answer(user_input, history, file_content):
+    """Return a cached answer (or None) and the cache key to store a new answer under"""
+    user_context = f"{session.get('user_name', 'User')}|{session.get('user_age', 'Unknown')}"
+    cache_key = answer_cache.make_key(user_input, history, file_content, user_context)
+    answer = answer_cache.get(cache_key)
+
+    # Paraphrases only match when no file content went into the answer
+    scope = answer_cache.context_digest(history, user_context)
+    if answer is None and semantic_cache is not None and not file_content:
+        answer = semantic_cache.get(user_input, scope)
+
+    return answer, (cache_key, scope)
+
+def store_answer(user_input, file_content, cache_key, model_response):
+    exact_key, scope = cache_key
+    answer_cache.put(exact_key, model_response)
+    if semantic_cache is not None and not file_content:
+        semantic_cache.put(user_input, scope, model_response)
+
+class Question:
+    """A question from the current session with its prompt built, ready for the model
+
+    Everything that needs the request and session happens here, so the
+    model can be called without them: by the routes below, or by the
+    async routes in asgi.py.
+    """
+
+    def __init__(self, user_input):
+        self.user_input = user_input
+        self.conversation_id = get_conversation_id()
+        self.chat = conversations.get_chat(self.conversation_id, backend)
+        self.context_message, self.file_content, self.skip_turns, self.cached = \
+            build_context_message(user_input, self.chat.history)
+        # Reuse the answer if this question was asked in the same context
+        self.cached_answer, self.cache_key = lookup_cached_answer(user_input, self.chat.history, self.file_content)
+
+    def answered(self, model_response, store=True):
+        """Record the answer; store also puts it in the answer caches"""
+        if store:
+            store_answer(self.user_input, self.file_content, self.cache_key, model_response)
+        # Store only the user's question, not the full context message
+        conversations.append(self.conversation_id, self.user_input, model_response)
+        compactor.maybe_compact(self.conversation_id)
+
+def send_admitted(question):
+    """Send a question once the admission controller grants a slot"""
+    with admission.slot():
+        return question.chat.send(question.context_message, skip_turns=question.skip_turns, cached=question.cached)
+
+def overloaded_response(error):
+    response = make_response(str(error), error.status)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message; data is JSON encoded so newlines survive"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',  # Stop proxies from buffering the stream
+}
+
 @app.route('/ask', methods=['POST'])
 def ask():
+    # Clients that accept an event stream get the answer chunk by chunk
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return ask_stream()
+
     try:
         user_input = request.form['user_input']
         if not user_input:
             return "Please provide a question", 400
 
-        # Get user info from session
-        user_name = session.get('user_name', 'User')
-        user_age = session.get('user_age', 'Unknown')
-        
-        # Check if the question is about file content
-        file_related_keywords = ['file', 'document', 'content', 'text', 'read', 'uploaded']
-        is_file_related = any(keyword in user_input.lower() for keyword in file_related_keywords)
-        
-        # Get uploaded file content only if question is related
-        file_content = ""
-        if is_file_related and 'uploaded_file' in session:
-            file_key = session['uploaded_file']
-            if file_key in UPLOAD_STORAGE:
-                file_data = UPLOAD_STORAGE[file_key]
-                try:
-                    file_content = read_file_content(file_data['data'], file_data['filename'])
-                    print(f"File content read successfully: {len(file_content)} characters")
-                except Exception as e:
-                    print(f"Error reading file content: {str(e)}")
-                    file_content = "Error reading file content"
-
-        # Create context-aware message
-        if is_file_related and file_content:
-            context_message = (
-                f"Context: You are talking to {user_name}, who is {user_age} years old.\n\n"
-                f"File Content: {file_content}\n\n"
-                f"User Question: {user_input}\n\n"
-                f"Instructions: Please answer the question using the provided file content."
-            )
-        else:
-            context_message = (
-                f"Context: You are talking to {user_name}, who is {user_age} years old.\n\n"
-                f"User Question: {user_input}"
-            )
-        
-        # Limit context size if needed
-        max_context_length = 30000  # Adjust based on model's limitations
-        if len(context_message) > max_context_length:
-            context_message = context_message[:max_context_length] + "... (content truncated)"
-        
-        chat_session = model.start_chat(history=history)
-        response = chat_session.send_message(context_message)
-        model_response = response.text
-
-        # Store messages in history with context
-        history.append({"role": "user", "parts": [user_input]})  # Store only user's question
-        history.append({"role": "model", "parts": [model_response]})
+        question = Question(user_input)
+        model_response, shared = question.cached_answer, True
+        if model_response is None:
+            # Identical questions already in flight share one model call
+            model_response, shared = inflight.do(question.cache_key[0], lambda: send_admitted(question))
+        question.answered(model_response, store=not shared)
 
         return model_response
 
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Error in ask route: {str(e)}")
         return str(e), 500
 
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    user_input = request.form.get('user_input')
+    if not user_input:
+        return "Please provide a question", 400
+
+    try:
+        question = Question(user_input)
+        shared = True
+        if question.cached_answer is None:
+            response, shared = inflight.stream(
+                question.cache_key[0],
+                lambda: admission.stream(lambda: question.chat.stream(
+                    question.context_message, skip_turns=question.skip_turns, cached=question.cached
+                )),
+            )
+            # Wait for the first chunk here so upstream errors still return a 500
+            first_chunk = next(response, '')
+        else:
+            response = iter(())
+            first_chunk = question.cached_answer
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error in ask_stream route: {str(e)}")
+        return str(e), 500
+
+    def generate():
+        chunks = [first_chunk]
+        yield sse_event(first_chunk)
+        try:
+            for text in response:
+                chunks.append(text)
+                yield sse_event(text)
+        except Exception as e:
+            print(f"Error while streaming response: {str(e)}")
+            yield sse_event(str(e), event='error')
+            return
+        finally:
+            # Let a shared model call know this client has gone away
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+
+        # Store the complete answer once the stream has finished
+        question.answered(''.join(chunks), store=not shared)
+        yield sse_event('', event='done')
+
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'conversations': conversations.stats(),
+        'compaction': compactor.stats(),
+        'answer_cache': answer_cache.stats(),
+        'inflight': inflight.stats(),
+        'admission': admission.stats(),
+        'extraction': extraction_pool.stats(),
+        'uploads': UPLOAD_STORAGE.stats(),
+        'documents': document_store.stats(),
+        'intent': intent_classifier.stats(),
+        'prompts': prompt_builder.stats(),
+        'context_cache': context_cache.stats() if context_cache is not None else None,
+        'backend': backend.stats(),
+        'semantic_cache': semantic_cache.stats() if semantic_cache is not None else None,
+        # Model calls made by the async routes, when served through asgi.py
+        'asgi': app.extensions['asgi'].stats() if 'asgi' in app.extensions else None,
+    })
+
 @app.route('/static/<path:path>')
 def send_static(path):
     response = make_response(send_from_directory('static', path))
@@ -213,6 +601,110 @@ def send_static(path):
         response.headers['Expires'] = '0'
     return response
 
+def build_vectors(document, index):
+    if passage_embedder is None:
+        return None
+    # Saved per content hash, so re-uploads and restarts skip embedding
+    return VectorIndex.load_or_build(
+        INDEX_CACHE_DIR,
+        f"{document.content_hash}-{PASSAGE_CHARS}-{PASSAGE_OVERLAP}-{passage_embedder.signature}",
+        passage_embedder,
+        [passage.text for passage in index.passages],
+        quantize=QUANTIZE_VECTORS,
+    )
+
+def store_upload(file_key, spool, filename):
+    """Parse and index a spooled upload once and keep it under its content hash"""
+    spool.flush()
+    if file_extension(filename) == 'pdf':
+        return store_pdf_upload(file_key, spool, filename)
+
+    document = extraction_pool.extract(spool.path, filename, spool.content_hash)
+    index = BM25Index(chunk_document(document, chunk_chars=PASSAGE_CHARS, overlap=PASSAGE_OVERLAP))
+    
+    entry = {
+        'document': document,
+        'index': index,
+        'vectors': build_vectors(document, index),
+        'filename': filename,
+        'spill_dir': None,
+        'loader': None
+    }
+    if document_store.should_spill(spool.size, document):
+        entry['spill_dir'] = document_store.spill(file_key, document, index, spool.detach())
+    UPLOAD_STORAGE[file_key] = entry
+    return entry
+
+def store_pdf_upload(file_key, spool, filename):
+    """Index the first pages of a PDF now and read the rest in the background"""
+    document = PdfDocument(filename, extraction_pool.page_count(spool.path, filename), spool.content_hash)
+    index = BM25Index([])
+    entry = {
+        'document': document,
+        'index': index,
+        'vectors': None,
+        'filename': filename,
+        'spill_dir': None,
+        'loader': None
+    }
+    size = spool.size
+    entry['loader'] = PageLoader(
+        extraction_pool,
+        spool.detach(),
+        document,
+        index,
+        batch_pages=PDF_BATCH_PAGES,
+        chunk_chars=PASSAGE_CHARS,
+        overlap=PASSAGE_OVERLAP,
+        on_progress=lambda loader: UPLOAD_STORAGE.resize(file_key),
+        on_complete=lambda loader: finish_pdf_upload(file_key, entry, size),
+    )
+    entry['loader'].load_first_batch()
+    UPLOAD_STORAGE[file_key] = entry
+    entry['loader'].start()
+    return entry
+
+def finish_pdf_upload(file_key, entry, size):
+    """Once every page is read: embed the passages and spill the PDF if it is large"""
+    document, index = entry['document'], entry['index']
+    entry['vectors'] = build_vectors(document, index)
+    if document_store.should_spill(size, document):
+        entry['spill_dir'] = document_store.spill(file_key, document, index, entry['loader'].take_path())
+    if not UPLOAD_STORAGE.resize(file_key) and entry['spill_dir']:
+        # Removed while it was being read
+        document_store.remove(entry['spill_dir'])
+
+def ingest_upload(spool, filename, owner):
+    """Store a spooled upload (unless it already is) and record owner as sharing it
+
+    Returns True if the file was already stored or being stored.
+    """
+    # Files are stored by content, so identical uploads share one parsed copy
+    file_key = spool.content_hash
+    deduplicated = UPLOAD_STORAGE.acquire(file_key, owner)
+    if not deduplicated:
+        def store():
+            # A flight that finished since the check above may have stored it already;
+            # storing it again would drop that entry, and the owners sharing it
+            if UPLOAD_STORAGE.acquire(file_key, owner):
+                return True
+            store_upload(file_key, spool, filename)
+            return False
+
+        # Concurrent uploads of the same file wait for one extraction
+        stored_before, shared = upload_inflight.do(file_key, store)
+        deduplicated = stored_before or shared
+        UPLOAD_STORAGE.acquire(file_key, owner)
+    return deduplicated
+
+def add_session_document(file_key, filename, owner):
+    """Add a file to the session's documents, letting go of the oldest past the limit"""
+    uploaded = [item for item in session.get('uploaded_files', []) if item[0] != file_key]
+    uploaded.append([file_key, filename])
+    while len(uploaded) > MAX_SESSION_DOCUMENTS:
+        release_session_document(uploaded.pop(0)[0], owner)
+    session['uploaded_files'] = uploaded
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -223,40 +715,220 @@ def upload_file():
         return jsonify({'status': 'error', 'message': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
+        # The body was streamed into a spool file, hashed and sniffed on the way
+        spool = file.stream
+        if not isinstance(spool, UploadSpool):
+            spool = UploadSpool.copy_from(file.stream, app.config['SPOOL_FOLDER'])
         try:
-            # Read file into memory
-            file_data = file.read()
-            
-            # Generate unique key for storage
-            file_key = f"{session.get('user_name', 'user')}_{secure_filename(file.filename)}"
+            if not spool.matches(file.filename.rsplit('.', 1)[1].lower()):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'File content does not match its extension'
+                }), 415
             
-            # Store in memory
-            UPLOAD_STORAGE[file_key] = {
-                'data': file_data,
-                'filename': file.filename
-            }
-            
-            # Store the key in session
-            session['uploaded_file'] = file_key
-            
-            # Test if we can read the file
-            content = read_file_content(file_data, file.filename)
-            if content.startswith("Error reading file"):
-                raise Exception(content)
+            owner = get_conversation_id()
+            deduplicated = ingest_upload(spool, file.filename, owner)
+            add_session_document(spool.content_hash, file.filename, owner)
             
             return jsonify({
                 'status': 'success',
-                'message': 'File uploaded and processed successfully'
+                'message': 'File uploaded and processed successfully',
+                'deduplicated': deduplicated,
+                'documents': document_list()
             })
             
+        except ExtractionTimeout as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Error processing file: {str(e)}'
+            }), 422
         except Exception as e:
             return jsonify({
                 'status': 'error',
                 'message': f'Error processing file: {str(e)}'
             }), 500
+        finally:
+            # Unless it was moved into the document store
+            spool.close()
     
     return jsonify({'status': 'error', 'message': 'Invalid file type'}), 400
 
+def finalize_job(upload_id):
+    job = finalize_jobs.get(upload_id)
+    return job[0] if job is not None else None
+
+def discard_finalize_job(upload_id, job):
+    """Forget the finalize job of an upload, unless it has been replaced by another"""
+    with finalize_jobs_lock:
+        if finalize_job(upload_id) is job:
+            del finalize_jobs[upload_id]
+
+def release_session_document(file_key, owner):
+    """Let go of owner's share of a session document, or of the upload that is still becoming one
+
+    A chunked upload's job only acquires its share when it finishes, so
+    that share is released once the job is done.
+    """
+    UPLOAD_STORAGE.release(file_key, owner)
+    job = finalize_job(file_key)
+    if job is None:
+        return
+    if job.done() and job.exception() is not None:
+        # A failed chunked upload has nothing left to report
+        discard_finalize_job(file_key, job)
+        return
+
+    def release_when_stored(job):
+        if job.exception() is None:
+            UPLOAD_STORAGE.release(job.result(), owner)
+    job.add_done_callback(release_when_stored)
+
+def remove_finished_finalize_jobs():
+    """Forget finished finalize jobs older than the uploads they stored"""
+    cutoff = time.monotonic() - UPLOAD_STORAGE.ttl
+    for upload_id, (job, submitted) in list(finalize_jobs.items()):
+        if job.done() and submitted < cutoff:
+            discard_finalize_job(upload_id, job)
+
+def resolve_finalized_uploads():
+    """Swap the upload ids of finished chunked uploads in the session for their content hashes
+
+    The hash is only known once the background job has read the whole
+    file, so until then the session lists the upload under its id.
+    """
+    uploaded = session.get('uploaded_files', [])
+    resolved, changed = [], False
+    for file_key, filename in uploaded:
+        job = finalize_job(file_key)
+        if job is not None and job.done() and job.exception() is None:
+            file_key, changed = job.result(), True
+        if not any(item[0] == file_key for item in resolved):
+            resolved.append([file_key, filename])
+    if changed:
+        session['uploaded_files'] = resolved
+
+def document_status(file_key):
+    if file_key in UPLOAD_STORAGE:
+        return 'ready', None
+    job = finalize_job(file_key)
+    if job is None:
+        return 'expired', None
+    if not job.done():
+        return 'processing', None
+    error = job.exception()
+    return ('error', str(error)) if error is not None else ('ready', None)
+
+def document_list():
+    resolve_finalized_uploads()
+    documents = []
+    for file_key, filename in session.get('uploaded_files', []):
+        status, error = document_status(file_key)
+        document = {'id': file_key, 'filename': filename, 'available': status == 'ready', 'status': status}
+        if error:
+            document['error'] = error
+        documents.append(document)
+    return documents
+
+def finalize_upload(path, filename, owner):
+    """Background half of a chunked upload: hash, parse and index the assembled file
+
+    Returns the file's content hash, its key in UPLOAD_STORAGE.
+    """
+    spool = UploadSpool.from_file(path)
+    try:
+        ingest_upload(spool, filename, owner)
+        return spool.content_hash
+    except Exception as e:
+        print(f"Error processing chunked upload {filename}: {str(e)}")
+        raise
+    finally:
+        spool.close()
+
+@app.route('/uploads', methods=['POST'])
+def start_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'status': 'error', 'message': 'Invalid file type'}), 400
+    try:
+        meta = chunked_uploads.init(filename, int(data.get('size') or 0), get_conversation_id())
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid file size'}), 400
+    except ChunkedUploadError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status
+    return jsonify({
+        'status': 'success',
+        'upload_id': meta['id'],
+        'chunk_size': meta['chunk_size'],
+        'chunks': meta['chunks']
+    }), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Which chunks have arrived, so an interrupted client knows what to resend"""
+    try:
+        status = chunked_uploads.status(upload_id, get_conversation_id())
+    except ChunkedUploadError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status
+    return jsonify({
+        'status': 'success',
+        'upload_id': upload_id,
+        'filename': status['filename'],
+        'chunks': status['chunks'],
+        'received': status['received'],
+        'missing': status['missing']
+    })
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    try:
+        size = chunked_uploads.put_chunk(upload_id, get_conversation_id(), index, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except ChunkedUploadError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status
+    return jsonify({'status': 'success', 'chunk': index, 'size': size})
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finish_chunked_upload(upload_id):
+    """Check the upload is complete and start parsing it; the client can chat meanwhile"""
+    owner = get_conversation_id()
+    try:
+        meta, path = chunked_uploads.finalize(upload_id, owner, app.config['SPOOL_FOLDER'])
+    except ChunkedUploadError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status
+
+    filename = meta['filename']
+    # Only the first bytes are read here; hashing the whole file is left to the job
+    if not kind_matches(sniff_file(path), file_extension(filename)):
+        os.remove(path)
+        return jsonify({'status': 'error', 'message': 'File content does not match its extension'}), 415
+
+    remove_finished_finalize_jobs()
+    job = finalize_executor.submit(finalize_upload, path, filename, owner)
+    with finalize_jobs_lock:
+        finalize_jobs[upload_id] = (job, time.monotonic())
+    add_session_document(upload_id, filename, owner)
+    return jsonify({
+        'status': 'success',
+        'message': 'File received, processing',
+        'id': upload_id,
+        'documents': document_list()
+    }), 202
+
+@app.route('/documents', methods=['GET'])
+def list_documents():
+    return jsonify({'status': 'success', 'documents': document_list()})
+
+@app.route('/documents/<file_key>', methods=['DELETE'])
+def remove_document(file_key):
+    resolve_finalized_uploads()
+    uploaded = session.get('uploaded_files', [])
+    if not any(item[0] == file_key for item in uploaded):
+        return jsonify({'status': 'error', 'message': 'No such document'}), 404
+    # Only this session's share is dropped; other documents and sessions are untouched
+    session['uploaded_files'] = [item for item in uploaded if item[0] != file_key]
+    release_session_document(file_key, get_conversation_id())
+    return jsonify({'status': 'success', 'documents': document_list()})
+
 @app.route('/speak', methods=['POST'])
 def speak():
     try:
@@ -290,6 +962,13 @@ def speak():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.errorhandler(RequestEntityTooLarge)
+def handle_too_large(error):
+    return jsonify({
+        'status': 'error',
+        'message': f"File is too large, the limit is {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB"
+    }), 413
+
 @app.errorhandler(500)
 def handle_500_error(error):
     return jsonify({
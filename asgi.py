@@ -0,0 +1,327 @@
+"""ASGI entry point: the Flask app with questions answered on an event loop
+
+    uvicorn asgi:application
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+POST /ask and /ask/stream are served by coroutines that await the model
+through the backend's async client, so a question waiting on the model
+holds no thread and one process can keep hundreds in flight. Preparing the
+prompt (retrieval, token counting, cache lookups) still runs in a worker
+thread inside the Flask request context, but only for those milliseconds.
+Every other route is the unchanged Flask view, called through a WSGI bridge
+on a small thread pool. app.py stays a WSGI app for gunicorn and flask run.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+
+from admission import AsyncAdmissionController, Overloaded
+from singleflight import AsyncSingleFlight
+import app as flask_module
+
+flask_app = flask_module.app
+
+# Limits for model calls made from the event loop, as configured for app.py
+async_admission = AsyncAdmissionController(
+    max_concurrent=flask_module.admission.max_concurrent,
+    max_queue=flask_module.admission.max_queue,
+    queue_timeout=flask_module.admission.queue_timeout,
+)
+async_inflight = AsyncSingleFlight()
+
+# Threads for the WSGI routes (uploads, documents, stats...) and prompt preparation
+bridge = ThreadPoolExecutor(max_workers=int(os.getenv('ASGI_THREADS', '16')), thread_name_prefix='asgi-bridge')
+
+ASYNC_ROUTES = {'/ask', '/ask/stream'}
+
+
+class ReceiveStream(io.RawIOBase):
+    """wsgi.input for a bridged request: reads the ASGI body as the WSGI app asks for it
+
+    Runs in a bridge thread and fetches each body message from the event
+    loop, so uploads are streamed into their spool files without being
+    buffered here first.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = b''
+        self.more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.buffer and self.more:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise OSError("Client disconnected")
+            self.buffer = message.get('body', b'')
+            self.more = message.get('more_body', False)
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ for an ASGI http scope, reading the request body from body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI strings are bytes decoded as latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # Without a Content-Length the body is read until it ends
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f"HTTP_{name}"
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    return environ
+
+
+async def read_body(receive, limit):
+    """The whole request body, or up to limit + 1 bytes so the app can reject it"""
+    chunks, size, more = [], 0, True
+    while more and size <= limit:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise OSError("Client disconnected")
+        chunks.append(message.get('body', b''))
+        size += len(chunks[-1])
+        more = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def send_headers(send, response):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()],
+    })
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def call_wsgi(scope, receive, send):
+    """Serve a request with the Flask app in a bridge thread"""
+    loop = asyncio.get_running_loop()
+    environ = wsgi_environ(scope, io.BufferedReader(ReceiveStream(receive, loop)))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    result = await loop.run_in_executor(bridge, flask_app, environ, start_response)
+    try:
+        chunks = iter(result)
+        done = object()
+        headers_sent = False
+        while True:
+            # Streamed responses are produced by the view as they are read
+            chunk = await loop.run_in_executor(bridge, next, chunks, done)
+            if not headers_sent:
+                await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+                headers_sent = True
+            if chunk is done:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        close = getattr(result, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(bridge, close)
+
+
+def in_bridge(fn, *args):
+    """Run fn in a bridge thread with this task's context variables, and so its request context"""
+    return asyncio.wrap_future(bridge.submit(contextvars.copy_context().run, fn, *args))
+
+
+async def prepare(user_input):
+    return await in_bridge(flask_module.Question, user_input)
+
+
+async def answered(question, model_response, store):
+    await in_bridge(question.answered, model_response, store)
+
+
+async def send_admitted(question):
+    async with async_admission.slot():
+        return await question.chat.send_async(
+            question.context_message, skip_turns=question.skip_turns, cached=question.cached
+        )
+
+
+async def ask_view():
+    """POST /ask; returns a Flask response value like the view in app.py"""
+    user_input = request.form.get('user_input')
+    if not user_input:
+        return "Please provide a question", 400
+    try:
+        question = await prepare(user_input)
+        model_response, shared = question.cached_answer, True
+        if model_response is None:
+            model_response, shared = await async_inflight.do(question.cache_key[0], lambda: send_admitted(question))
+        await answered(question, model_response, not shared)
+        return model_response
+    except Overloaded as e:
+        return flask_module.overloaded_response(e)
+    except Exception as e:
+        print(f"Error in async ask route: {str(e)}")
+        return str(e), 500
+
+
+async def ask_stream(receive, send):
+    """POST /ask/stream, sent as Server-Sent Events straight from the model's chunks"""
+    user_input = request.form.get('user_input')
+    if not user_input:
+        return await send_response(send, flask_app.make_response(("Please provide a question", 400)))
+
+    chunks = None
+    try:
+        question = await prepare(user_input)
+        shared = True
+        if question.cached_answer is None:
+            chunks, shared = async_inflight.stream(
+                question.cache_key[0],
+                lambda: async_admission.stream(lambda: question.chat.stream_async(
+                    question.context_message, skip_turns=question.skip_turns, cached=question.cached
+                )),
+            )
+            # Wait for the first chunk here so upstream errors still return a 500
+            first_chunk = await anext(chunks, '')
+        else:
+            first_chunk = question.cached_answer
+    except Overloaded as e:
+        return await send_response(send, flask_module.overloaded_response(e))
+    except Exception as e:
+        print(f"Error in async ask_stream route: {str(e)}")
+        if chunks is not None:
+            await chunks.aclose()
+        return await send_response(send, flask_app.make_response((str(e), 500)))
+
+    # Headers (and the session cookie) go out before the first event
+    response = flask_app.process_response(flask_app.response_class(
+        mimetype='text/event-stream', headers=flask_module.SSE_HEADERS
+    ))
+    await send_headers(send, response)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        pieces = [first_chunk]
+        await send_event(send, flask_module.sse_event(first_chunk))
+        if chunks is not None:
+            try:
+                async for text in chunks:
+                    if disconnected.done():
+                        return
+                    pieces.append(text)
+                    await send_event(send, flask_module.sse_event(text))
+            except Exception as e:
+                print(f"Error while streaming response: {str(e)}")
+                await send_event(send, flask_module.sse_event(str(e), event='error'), more=False)
+                return
+        # Store the complete answer once the stream has finished
+        await answered(question, ''.join(pieces), not shared)
+        await send_event(send, flask_module.sse_event('', event='done'), more=False)
+    finally:
+        disconnected.cancel()
+        if chunks is not None:
+            # Let a shared model call know this client has gone away
+            await chunks.aclose()
+
+
+async def send_event(send, event, more=True):
+    await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': more})
+
+
+async def send_response(send, response):
+    # Also saves the session into the response, which needs the request context
+    response = flask_app.process_response(response)
+    await send_headers(send, response)
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def ask(scope, receive, send):
+    """Serve /ask and /ask/stream inside a Flask request context kept across awaits
+
+    Flask keeps its request context in context variables, which belong to
+    the task serving this request, so other requests on the loop never see it.
+    """
+    limit = flask_app.config.get('MAX_CONTENT_LENGTH') or 1024 * 1024
+    environ = wsgi_environ(scope, io.BytesIO(await read_body(receive, limit)))
+    context = flask_app.request_context(environ)
+    context.push()
+    try:
+        wants_stream = scope['path'] == '/ask/stream' or 'text/event-stream' in request.headers.get('Accept', '')
+        if wants_stream:
+            await ask_stream(receive, send)
+            return
+        await send_response(send, flask_app.make_response(await ask_view()))
+    finally:
+        context.pop()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            bridge.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if scope['method'] == 'POST' and scope['path'] in ASYNC_ROUTES:
+        await ask(scope, receive, send)
+    else:
+        await call_wsgi(scope, receive, send)
+
+
+def stats():
+    return {
+        'admission': async_admission.stats(),
+        'inflight': async_inflight.stats(),
+    }
+
+
+# /stats (a WSGI route) reports the event loop's limits too
+flask_app.extensions['asgi'] = sys.modules[__name__]
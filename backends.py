@@ -0,0 +1,436 @@
+import asyncio
+import os
+import random
+import time
+import threading
+import hashlib
+from datetime import timedelta
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+# Generation config shared by every Gemini model we create
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
+
+
+class BackendError(Exception):
+    """Raised when the model backend fails to produce an answer"""
+
+
+class CachedContext:
+    """Handle for text the backend keeps server-side to be reused across calls
+
+    name identifies it to the backend, token_count is what the model reads
+    from it on every call that references it, and it is gone after
+    expires_at (a time.time() value) unless refreshed.
+    """
+
+    def __init__(self, name, token_count, expires_at, native=None):
+        self.name = name
+        self.token_count = token_count
+        self.expires_at = expires_at
+        self.native = native  # the backend's own object for it, if any
+
+
+class ChatHandle:
+    """Live chat for one conversation
+
+    The handle keeps the conversation so far and only ever has new turns
+    added to it, instead of being rebuilt from the full history on every
+    question. Sending does not change the history; the caller records the
+    turn it wants to keep (usually the bare question rather than the full
+    prompt) with record.
+    """
+
+    def __init__(self, backend, history):
+        self.backend = backend
+        self.history = list(history)
+
+    def send(self, message, skip_turns=0, cached=None):
+        """Send message; skip_turns leaves that many of the oldest turns out of the request
+
+        cached is a CachedContext the model reads before the conversation.
+        """
+        return self.backend.send(self.history[2 * skip_turns:], message, cached=cached)
+
+    def stream(self, message, skip_turns=0, cached=None):
+        return self.backend.stream(self.history[2 * skip_turns:], message, cached=cached)
+
+    async def send_async(self, message, skip_turns=0, cached=None):
+        return await self.backend.send_async(self.history[2 * skip_turns:], message, cached=cached)
+
+    def stream_async(self, message, skip_turns=0, cached=None):
+        return self.backend.stream_async(self.history[2 * skip_turns:], message, cached=cached)
+
+    def record(self, user_text, model_text):
+        self.history.append({"role": "user", "parts": [user_text]})
+        self.history.append({"role": "model", "parts": [model_text]})
+
+    def drop_oldest_turn(self):
+        del self.history[:2]
+
+
+class ModelBackend:
+    """Interface every chat model backend implements
+
+    history is a list of {"role": ..., "parts": [...]} dicts, the same format
+    model.start_chat accepts.
+    """
+
+    name = 'base'
+    # Whether create_cached_context is available
+    supports_context_cache = False
+
+    def send(self, history, message, cached=None):
+        """Send one message and return the complete answer text"""
+        raise NotImplementedError
+
+    def stream(self, history, message, cached=None):
+        """Send one message and yield the answer text in chunks as it arrives"""
+        raise NotImplementedError
+
+    async def send_async(self, history, message, cached=None):
+        """send for coroutines; backends without an async client run send in a worker thread"""
+        return await asyncio.to_thread(self.send, history, message, cached)
+
+    async def stream_async(self, history, message, cached=None):
+        """stream for coroutines, as an async iterator of text chunks"""
+        chunks = self.stream(history, message, cached=cached)
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+    def count_tokens(self, text):
+        """Return the number of tokens the model would see for text"""
+        raise NotImplementedError
+
+    def start_chat(self, history):
+        """Return a ChatHandle holding history"""
+        return ChatHandle(self, history)
+
+    def create_cached_context(self, text, ttl, display_name=None):
+        """Store text server-side for ttl seconds; returns a CachedContext"""
+        raise NotImplementedError
+
+    def refresh_cached_context(self, cached, ttl):
+        """Keep a cached context for another ttl seconds from now"""
+        raise NotImplementedError
+
+    def delete_cached_context(self, cached):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'name': self.name}
+
+
+class GeminiChat(ChatHandle):
+    """Chat handle that keeps history already converted to Gemini contents"""
+
+    def __init__(self, backend, history):
+        super().__init__(backend, history)
+        self._contents = [self._content(message["role"], message["parts"][0]) for message in self.history]
+
+    @staticmethod
+    def _content(role, text):
+        return genai.protos.Content(role=role, parts=[genai.protos.Part(text=text)])
+
+    def send(self, message, skip_turns=0, cached=None):
+        contents = self._contents[2 * skip_turns:] + [self._content("user", message)]
+        return self.backend.model_for(cached).generate_content(contents).text
+
+    def stream(self, message, skip_turns=0, cached=None):
+        contents = self._contents[2 * skip_turns:] + [self._content("user", message)]
+        for chunk in self.backend.model_for(cached).generate_content(contents, stream=True):
+            text = chunk.text
+            if text:
+                yield text
+
+    async def send_async(self, message, skip_turns=0, cached=None):
+        contents = self._contents[2 * skip_turns:] + [self._content("user", message)]
+        response = await self.backend.model_for(cached).generate_content_async(contents)
+        return response.text
+
+    async def stream_async(self, message, skip_turns=0, cached=None):
+        contents = self._contents[2 * skip_turns:] + [self._content("user", message)]
+        response = await self.backend.model_for(cached).generate_content_async(contents, stream=True)
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                yield text
+
+    def record(self, user_text, model_text):
+        super().record(user_text, model_text)
+        self._contents.append(self._content("user", user_text))
+        self._contents.append(self._content("model", model_text))
+
+    def drop_oldest_turn(self):
+        super().drop_oldest_turn()
+        del self._contents[:2]
+
+
+class GeminiBackend(ModelBackend):
+    """Backend that talks to the Gemini API"""
+
+    name = 'gemini'
+    # Context caching needs a versioned model name, e.g. gemini-1.5-flash-002
+    supports_context_cache = True
+
+    def __init__(self, system_instruction, model_name="gemini-1.5-flash",
+                 generation_config=None, api_key=None):
+        if genai is None:
+            raise BackendError("google-generativeai is not installed")
+        self.system_instruction = system_instruction
+        self.model_name = model_name
+        self.generation_config = generation_config or GENERATION_CONFIG
+
+        # Configure the Gemini API with error handling
+        try:
+            genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        except Exception as e:
+            print(f"Error configuring Gemini API: {str(e)}")
+
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=self.generation_config,
+            system_instruction=system_instruction,
+        )
+
+    def model_for(self, cached):
+        """The model to call: one bound to the cached context, if there is one"""
+        if cached is None:
+            return self.model
+        return cached.native[1]
+
+    def send(self, history, message, cached=None):
+        chat_session = self.model_for(cached).start_chat(history=history)
+        response = chat_session.send_message(message)
+        return response.text
+
+    def stream(self, history, message, cached=None):
+        chat_session = self.model_for(cached).start_chat(history=history)
+        for chunk in chat_session.send_message(message, stream=True):
+            text = chunk.text
+            if text:
+                yield text
+
+    async def send_async(self, history, message, cached=None):
+        chat_session = self.model_for(cached).start_chat(history=history)
+        response = await chat_session.send_message_async(message)
+        return response.text
+
+    async def stream_async(self, history, message, cached=None):
+        chat_session = self.model_for(cached).start_chat(history=history)
+        response = await chat_session.send_message_async(message, stream=True)
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                yield text
+
+    def count_tokens(self, text):
+        return self.model.count_tokens(text).total_tokens
+
+    def start_chat(self, history):
+        return GeminiChat(self, history)
+
+    def create_cached_context(self, text, ttl, display_name=None):
+        # The system instruction has to live in the cache; requests using it cannot set one
+        try:
+            content = genai.caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                display_name=display_name,
+                system_instruction=self.system_instruction,
+                contents=[text],
+                ttl=timedelta(seconds=ttl),
+            )
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content=content,
+                generation_config=self.generation_config,
+            )
+        except Exception as e:
+            raise BackendError(f"Could not create cached context: {str(e)}")
+        return CachedContext(
+            content.name,
+            content.usage_metadata.total_token_count,
+            time.time() + ttl,
+            native=(content, model),
+        )
+
+    def refresh_cached_context(self, cached, ttl):
+        try:
+            cached.native[0].update(ttl=timedelta(seconds=ttl))
+        except Exception as e:
+            raise BackendError(f"Could not refresh cached context: {str(e)}")
+        cached.expires_at = time.time() + ttl
+
+    def delete_cached_context(self, cached):
+        try:
+            cached.native[0].delete()
+        except Exception as e:
+            raise BackendError(f"Could not delete cached context: {str(e)}")
+
+
+class FakeBackend(ModelBackend):
+    """In-process backend with deterministic answers for offline load tests
+
+    Answers are derived from a hash of the message, so the same question
+    always gets the same answer. latency is the delay before the first
+    token, tokens_per_second paces the rest of the answer (0 means no
+    pacing), and failure_rate is the chance that a call raises BackendError.
+
+    Cached contexts are emulated in memory with the same lifetime rules as
+    Gemini's: calls referencing one that expired or was deleted fail. The
+    answer says how many cached tokens it read, and stats counts the input
+    tokens sent with calls against those read from cached contexts, so
+    cache hits and the tokens they save can be checked offline.
+    """
+
+    name = 'fake'
+    supports_context_cache = True
+
+    WORDS = (
+        "recursion", "stack", "queue", "pointer", "array", "loop", "function",
+        "variable", "compiler", "memory", "algorithm", "complexity", "graph",
+        "tree", "hash", "string", "object", "class", "thread", "cache",
+    )
+
+    def __init__(self, latency=0.05, tokens_per_second=200, failure_rate=0.0,
+                 answer_tokens=60, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.answer_tokens = answer_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._contexts = {}  # name -> CachedContext
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        self.contexts_created = 0
+
+    def _start_call(self, history, message, cached):
+        tokens = self.count_tokens(message) + sum(self.count_tokens(turn["parts"][0]) for turn in history)
+        with self._lock:
+            self.calls += 1
+            if cached is not None:
+                live = self._contexts.get(cached.name)
+                if live is None or live.expires_at <= time.time():
+                    self._contexts.pop(cached.name, None)
+                    raise BackendError(f"Cached context {cached.name} not found or expired")
+                self.cached_input_tokens += live.token_count
+            self.input_tokens += tokens
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise BackendError("Simulated backend failure")
+
+    def _answer_tokens(self, history, message, cached=None):
+        digest = hashlib.sha256(message.encode('utf-8')).digest()
+        if cached is not None:
+            tokens = [f"Answer ({len(history) // 2} previous turns, {cached.token_count} cached tokens):"]
+        else:
+            tokens = [f"Answer ({len(history) // 2} previous turns):"]
+        for i in range(self.answer_tokens):
+            tokens.append(self.WORDS[digest[i % len(digest)] % len(self.WORDS)])
+        return [token + ' ' for token in tokens]
+
+    def send(self, history, message, cached=None):
+        self._start_call(history, message, cached)
+        tokens = self._answer_tokens(history, message, cached)
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += len(tokens) / self.tokens_per_second
+        time.sleep(delay)
+        return ''.join(tokens)
+
+    def stream(self, history, message, cached=None):
+        self._start_call(history, message, cached)
+        tokens = self._answer_tokens(history, message, cached)
+        time.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield token
+
+    async def send_async(self, history, message, cached=None):
+        self._start_call(history, message, cached)
+        tokens = self._answer_tokens(history, message, cached)
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += len(tokens) / self.tokens_per_second
+        await asyncio.sleep(delay)
+        return ''.join(tokens)
+
+    async def stream_async(self, history, message, cached=None):
+        self._start_call(history, message, cached)
+        tokens = self._answer_tokens(history, message, cached)
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield token
+
+    def count_tokens(self, text):
+        # Roughly four characters per token, like the Gemini tokenizer on English
+        return max(1, len(text) // 4)
+
+    def create_cached_context(self, text, ttl, display_name=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.contexts_created += 1
+            name = f"cachedContents/fake-{self.contexts_created}"
+            cached = CachedContext(name, self.count_tokens(text), time.time() + ttl)
+            self._contexts[name] = cached
+        # The caller gets its own handle, like a client object of the real API
+        return CachedContext(name, cached.token_count, cached.expires_at)
+
+    def refresh_cached_context(self, cached, ttl):
+        with self._lock:
+            live = self._contexts.get(cached.name)
+            if live is None or live.expires_at <= time.time():
+                raise BackendError(f"Cached context {cached.name} not found or expired")
+            live.expires_at = cached.expires_at = time.time() + ttl
+
+    def delete_cached_context(self, cached):
+        with self._lock:
+            if self._contexts.pop(cached.name, None) is None:
+                raise BackendError(f"Cached context {cached.name} not found")
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                'name': self.name,
+                'calls': self.calls,
+                'input_tokens': self.input_tokens,
+                'cached_input_tokens': self.cached_input_tokens,
+                'cached_contexts': sum(1 for cached in self._contexts.values() if cached.expires_at > now),
+                'cached_contexts_created': self.contexts_created,
+            }
+
+
+def create_backend(system_instruction, name=None):
+    """Create the backend selected by name or the CHATBOT_BACKEND env variable"""
+    name = (name or os.getenv('CHATBOT_BACKEND', 'gemini')).lower()
+    if name == 'gemini':
+        return GeminiBackend(
+            system_instruction,
+            model_name=os.getenv('GEMINI_MODEL', 'gemini-1.5-flash'),
+        )
+    if name == 'fake':
+        return FakeBackend(
+            latency=float(os.getenv('FAKE_BACKEND_LATENCY', '0.05')),
+            tokens_per_second=float(os.getenv('FAKE_BACKEND_TOKENS_PER_SECOND', '200')),
+            failure_rate=float(os.getenv('FAKE_BACKEND_FAILURE_RATE', '0')),
+            seed=int(os.getenv('FAKE_BACKEND_SEED', '0')),
+        )
+    raise ValueError(f"Unknown backend: {name}")
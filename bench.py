@@ -0,0 +1,372 @@
+"""Load-test harness for the chatbot
+
+Runs requests against the Flask app in-process through its test client, so
+it needs no server. The fake backend needs no network or API key, and the
+same numbers can be taken against Gemini for comparison:
+
+    python bench.py ask --backend fake --requests 200 --concurrency 16
+    python bench.py ask --stream
+    python bench.py upload --size-kb 512
+    python bench.py cli --backend gemini --requests 10
+    python bench.py prompt --requests 100000
+    python bench.py concurrency --inflight 200 --latency 2
+"""
+import argparse
+import asyncio
+import io
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, latencies, elapsed, errors=0):
+    if not latencies:
+        print(f"{name}: no successful requests, {errors} errors")
+        return
+    print(
+        f"{name}: {len(latencies)} ok, {errors} errors in {elapsed:.2f}s "
+        f"({len(latencies) / elapsed:.1f} req/s) | "
+        f"mean {statistics.mean(latencies) * 1000:.1f}ms "
+        f"p50 {percentile(latencies, 0.5) * 1000:.1f}ms "
+        f"p95 {percentile(latencies, 0.95) * 1000:.1f}ms "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms"
+    )
+
+
+def run_concurrently(worker, requests, concurrency):
+    """Call worker(client_index, request_index) across threads and time each call
+
+    worker returns the latency to record, or None when it measured nothing.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def loop(client_index):
+        while True:
+            with lock:
+                request_index = next(counter, None)
+            if request_index is None:
+                return
+            started = time.perf_counter()
+            try:
+                measured = worker(client_index, request_index)
+            except Exception as e:
+                print(f"Request {request_index} failed: {e}")
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(measured if measured is not None else time.perf_counter() - started)
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started, errors[0]
+
+
+def make_clients(app_module, count):
+    clients = []
+    for i in range(count):
+        client = app_module.app.test_client()
+        client.post('/save_user_info', data={'name': f'bench{i}', 'age': '20'})
+        clients.append(client)
+    return clients
+
+
+def bench_ask(app_module, args):
+    clients = make_clients(app_module, args.concurrency)
+    questions = [f"What is question number {i % args.distinct}?" for i in range(args.requests)]
+    first_byte = []
+
+    def worker(client_index, request_index):
+        data = {'user_input': questions[request_index]}
+        if not args.stream:
+            response = clients[client_index].post('/ask', data=data)
+            if response.status_code != 200:
+                raise RuntimeError(f"status {response.status_code}")
+            return None
+
+        started = time.perf_counter()
+        response = clients[client_index].post('/ask/stream', data=data, buffered=False)
+        if response.status_code != 200:
+            raise RuntimeError(f"status {response.status_code}")
+        chunks = iter(response.response)
+        next(chunks, None)
+        first_byte.append(time.perf_counter() - started)
+        for _ in chunks:
+            pass
+        response.close()
+        return time.perf_counter() - started
+
+    latencies, elapsed, errors = run_concurrently(worker, args.requests, args.concurrency)
+    report('ask/stream' if args.stream else 'ask', latencies, elapsed, errors)
+    if first_byte:
+        report('time to first byte', first_byte, elapsed)
+
+
+def bench_upload(app_module, args):
+    clients = make_clients(app_module, args.concurrency)
+    line = b"Binary search halves the search interval on every comparison.\n"
+    payload = line * (args.size_kb * 1024 // len(line) + 1)
+
+    def worker(client_index, request_index):
+        data = {'file': (io.BytesIO(payload), f'notes{request_index % args.distinct}.txt')}
+        response = clients[client_index].post('/upload', data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"status {response.status_code}")
+
+    latencies, elapsed, errors = run_concurrently(worker, args.requests, args.concurrency)
+    report('upload', latencies, elapsed, errors)
+
+
+def bench_cli(args):
+    import chatbot
+    backend = chatbot.create_backend(chatbot.SYSTEM_INSTRUCTION)
+    chat = backend.start_chat(history=[])
+    latencies = []
+    started = time.perf_counter()
+    for i in range(args.requests):
+        call_started = time.perf_counter()
+        chatbot.reply(chat, f"What is question number {i % args.distinct}?")
+        latencies.append(time.perf_counter() - call_started)
+    report('cli', latencies, time.perf_counter() - started)
+
+
+def bench_prompt(args):
+    """Time prompt assembly alone, as the old f-strings did it and with prompts.py
+
+    Both build the text the context budget is measured on and the final
+    prompt, as build_context_message does for every question.
+    """
+    from prompts import PromptBuilder
+    builder = PromptBuilder()
+    question = "What does chapter 3 say about binary search trees?"
+    file_content = "[notes.txt] A binary search tree keeps smaller keys on the left. " * 40
+
+    def f_strings(file_content):
+        header = f"Context: You are talking to {'bench'}, who is {'20'} years old.\n\n"
+        question_text = f"User Question: {question}"
+        instructions = (
+            "\n\nInstructions: Please answer the question using the provided file content. "
+            "Each excerpt starts with the document it came from; cite it when you use it."
+        )
+        fixed_text = header + question_text + instructions
+        return fixed_text, f"{header}File Content (most relevant excerpts): {file_content}\n\n{question_text}{instructions}"
+
+    def builder_prompt(file_content):
+        prefix = builder.prefix('bench-session', 'bench', '20')
+        return builder.frame(prefix, question), builder.build(prefix, question, file_content)
+
+    assert f_strings(file_content)[1] == builder_prompt(file_content)[1]
+    for name, assemble in (('f-strings', f_strings), ('prompts.py', builder_prompt)):
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            assemble(file_content)
+        elapsed = time.perf_counter() - started
+
+        # Memory that is allocated while a prompt is assembled but not part of the result
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        prompt = assemble(file_content)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name}: {elapsed / args.requests * 1e9:.0f}ns per prompt, "
+            f"{current - before} bytes kept, {peak - current} bytes of intermediates"
+        )
+        del prompt
+
+
+class AsgiClient:
+    """In-process client for asgi.application that keeps its session cookie like the test client"""
+
+    def __init__(self, application):
+        self.application = application
+        self.cookie = None
+
+    async def post(self, path, data):
+        body = urlencode(data).encode('utf-8')
+        headers = [
+            (b'host', b'localhost'),
+            (b'content-type', b'application/x-www-form-urlencoded'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+        ]
+        if self.cookie:
+            headers.append((b'cookie', self.cookie))
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': path, 'root_path': '', 'query_string': b'', 'headers': headers,
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        }
+        pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        finished = asyncio.Event()
+        response = {'status': None, 'chunks': []}
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                for name, value in message['headers']:
+                    if name == b'set-cookie':
+                        self.cookie = value.split(b';', 1)[0]
+            else:
+                response['chunks'].append(message.get('body', b''))
+                if not message.get('more_body', False):
+                    finished.set()
+
+        await self.application(scope, receive, send)
+        finished.set()
+        return response['status'], b''.join(response['chunks'])
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_concurrency_server(app_module, args):
+    """Hold --inflight questions open at once on one server model and measure the memory it costs
+
+    wsgi gives every question its own thread, as a threaded WSGI server
+    must; asgi runs them all as tasks on one event loop. Memory is the
+    growth of peak RSS over the warmed-up process.
+    """
+    questions = [f"What is question number {i}?" for i in range(args.inflight)]
+    if args.server == 'wsgi':
+        clients = make_clients(app_module, args.inflight)
+        clients[0].post('/ask', data={'user_input': 'warm up'})
+        baseline = peak_rss_mb()
+        latencies, elapsed, errors = run_concurrently(
+            lambda client_index, request_index: check_status(
+                clients[client_index].post('/ask', data={'user_input': questions[request_index]}).status_code
+            ),
+            args.inflight,
+            args.inflight,
+        )
+    else:
+        import asgi
+        clients = [AsgiClient(asgi.application) for _ in range(args.inflight)]
+
+        async def run():
+            for i, client in enumerate(clients):
+                await client.post('/save_user_info', {'name': f'bench{i}', 'age': '20'})
+            await clients[0].post('/ask', {'user_input': 'warm up'})
+            nonlocal baseline
+            baseline = peak_rss_mb()
+
+            async def one(client, question):
+                started = time.perf_counter()
+                status, body = await client.post('/ask', {'user_input': question})
+                check_status(status)
+                return time.perf_counter() - started
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one(c, q) for c, q in zip(clients, questions)), return_exceptions=True)
+            return results, time.perf_counter() - started
+
+        baseline = 0
+        results, elapsed = asyncio.run(run())
+        latencies = [result for result in results if not isinstance(result, BaseException)]
+        errors = len(results) - len(latencies)
+        for result in results:
+            if isinstance(result, BaseException):
+                print(f"Request failed: {result}")
+                break
+
+    growth = max(peak_rss_mb() - baseline, 0.01)
+    report(f"{args.server} ({args.inflight} in flight)", latencies, elapsed, errors)
+    print(
+        f"{args.server}: peak RSS +{growth:.1f} MB over {baseline:.1f} MB, "
+        f"{len(latencies) / growth:.1f} concurrent chats per MB, {threading.active_count()} threads at the end"
+    )
+
+
+def check_status(status):
+    if status != 200:
+        raise RuntimeError(f"status {status}")
+
+
+def bench_concurrency(args):
+    """Run the WSGI and ASGI servers in fresh processes so their memory is measured apart"""
+    env = dict(
+        os.environ,
+        CHATBOT_BACKEND=args.backend,
+        FAKE_BACKEND_LATENCY=str(args.latency),
+        FAKE_BACKEND_TOKENS_PER_SECOND='0',
+        # Admission would otherwise queue most of them
+        MODEL_MAX_CONCURRENCY=str(args.inflight),
+        MODEL_QUEUE_SIZE=str(args.inflight),
+    )
+    for server in ('wsgi', 'asgi'):
+        subprocess.run(
+            [sys.executable, __file__, 'concurrency', '--server', server, '--backend', args.backend,
+             '--inflight', str(args.inflight), '--latency', str(args.latency)],
+            env=env,
+            check=True,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('target', choices=['ask', 'upload', 'cli', 'prompt', 'concurrency'])
+    parser.add_argument('--backend', default='fake', help="Backend to load, 'fake' or 'gemini'")
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--distinct', type=int, default=20, help="Number of distinct questions or files")
+    parser.add_argument('--stream', action='store_true', help="Use /ask/stream and report time to first byte")
+    parser.add_argument('--size-kb', type=int, default=256, help="Size of each uploaded file")
+    parser.add_argument('--inflight', type=int, default=200, help="Questions held open at once (concurrency)")
+    parser.add_argument('--latency', type=float, default=2.0, help="Fake backend latency in seconds (concurrency)")
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # The backend is picked when app.py is imported
+    os.environ['CHATBOT_BACKEND'] = args.backend
+
+    if args.target == 'cli':
+        bench_cli(args)
+        return
+    if args.target == 'prompt':
+        bench_prompt(args)
+        return
+    if args.target == 'concurrency' and args.server is None:
+        bench_concurrency(args)
+        return
+
+    import app as app_module
+    app_module.app.debug = False
+    if args.target == 'ask':
+        bench_ask(app_module, args)
+    elif args.target == 'concurrency':
+        bench_concurrency_server(app_module, args)
+    else:
+        bench_upload(app_module, args)
+
+
+if __name__ == '__main__':
+    main()
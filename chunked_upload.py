@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+class ChunkedUploadError(Exception):
+    """Raised for a chunked upload request that cannot be honoured
+
+    status is the HTTP status the request should get.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChunkedUploads:
+    """Resumable uploads sent as numbered chunks
+
+    init preallocates the whole file; every chunk is checked against its
+    SHA-256 and written at its own offset with pwrite, so chunks can arrive
+    in any order, be retried, and need no assembly step. Which chunks have
+    arrived is kept on disk next to the data, so an upload can be resumed
+    after a dropped connection or a restart. Uploads not touched for ttl
+    seconds are deleted. Every upload belongs to the owner that started
+    it; to anyone else it does not exist.
+    """
+
+    def __init__(self, directory, chunk_size=4 * 1024 * 1024, max_size=50 * 1024 * 1024, ttl=24 * 60 * 60):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, upload_id, name=''):
+        # Ids are generated here; anything else is not a valid upload
+        if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+            raise ChunkedUploadError("No such upload", 404)
+        return os.path.join(self.directory, upload_id, name)
+
+    def _meta(self, upload_id, owner):
+        try:
+            with open(self._path(upload_id, 'meta.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise ChunkedUploadError("No such upload", 404)
+        if meta['owner'] != owner:
+            raise ChunkedUploadError("No such upload", 404)
+        return meta
+
+    def init(self, filename, size, owner):
+        """Start an upload of size bytes; returns its metadata, including the id"""
+        self.remove_expired()
+        if size <= 0:
+            raise ChunkedUploadError("File is empty")
+        if size > self.max_size:
+            raise ChunkedUploadError(f"File is too large, the limit is {self.max_size // (1024 * 1024)} MB", 413)
+
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._path(upload_id))
+        chunks = -(-size // self.chunk_size)
+        meta = {
+            'id': upload_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'chunks': chunks,
+            'owner': owner,
+        }
+        # Sparse until written; chunks fill their own ranges of the one file
+        with open(self._path(upload_id, 'data'), 'wb') as f:
+            f.truncate(size)
+        with open(self._path(upload_id, 'received'), 'wb') as f:
+            f.write(bytes(chunks))
+        with open(self._path(upload_id, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return meta
+
+    def received(self, upload_id):
+        """Indices of the chunks that have arrived"""
+        with open(self._path(upload_id, 'received'), 'rb') as f:
+            return [index for index, flag in enumerate(f.read()) if flag]
+
+    def status(self, upload_id, owner):
+        meta = self._meta(upload_id, owner)
+        received = set(self.received(upload_id))
+        return dict(meta, received=sorted(received), missing=[i for i in range(meta['chunks']) if i not in received])
+
+    def put_chunk(self, upload_id, owner, index, stream, checksum):
+        """Write chunk index from stream, verifying it against its hex SHA-256"""
+        meta = self._meta(upload_id, owner)
+        if not 0 <= index < meta['chunks']:
+            raise ChunkedUploadError(f"Chunk {index} is out of range", 416)
+        if not checksum:
+            raise ChunkedUploadError("Missing chunk checksum")
+        offset = index * meta['chunk_size']
+        expected = min(meta['chunk_size'], meta['size'] - offset)
+
+        # One chunk is bounded by chunk_size, so it is checked in memory before touching the file
+        data = stream.read(expected + 1)
+        if len(data) != expected:
+            raise ChunkedUploadError(f"Chunk {index} should be {expected} bytes, got {len(data)}")
+        if hashlib.sha256(data).hexdigest() != checksum.lower():
+            raise ChunkedUploadError(f"Chunk {index} does not match its checksum", 422)
+
+        fd = os.open(self._path(upload_id, 'data'), os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        # Mark the chunk only once its bytes are on disk
+        fd = os.open(self._path(upload_id, 'received'), os.O_WRONLY)
+        try:
+            os.pwrite(fd, b'\x01', index)
+        finally:
+            os.close(fd)
+        os.utime(self._path(upload_id, 'meta.json'))
+        return expected
+
+    def finalize(self, upload_id, owner, spool_directory):
+        """Hand over the file of a complete upload and forget the upload
+
+        The data file is moved, not copied, into spool_directory and is not
+        read here. Returns the upload's metadata and the file's new path.
+        """
+        meta = self._meta(upload_id, owner)
+        missing = meta['chunks'] - len(self.received(upload_id))
+        if missing:
+            raise ChunkedUploadError(f"{missing} chunks are still missing", 409)
+        os.makedirs(spool_directory, exist_ok=True)
+        path = os.path.join(spool_directory, f"upload-{upload_id}.part")
+        try:
+            # Only one finalize can claim the data
+            os.replace(self._path(upload_id, 'data'), path)
+        except FileNotFoundError:
+            raise ChunkedUploadError("Upload is already being finalized", 409)
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+        return meta, path
+
+    def remove_expired(self):
+        """Delete uploads that have not been touched for ttl seconds"""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for name in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, name, 'meta.json')
+            try:
+                if os.path.getmtime(meta_path) < cutoff:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
@@ -0,0 +1,89 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below between a student and their mentor in a "
+    "short paragraph. Keep the student's name, what they are studying, questions "
+    "they asked and any facts or decisions later answers may depend on. Reply "
+    "with the summary only.\n\n"
+    "{previous_summary}"
+    "{transcript}"
+)
+
+
+class HistoryCompactor:
+    """Folds the oldest turns of long conversations into a running summary
+
+    Once a conversation's stored history passes token_budget tokens,
+    everything but the last keep_turns turns is summarized by the backend
+    and replaced with a single summary turn. Summaries are generated on a
+    background thread, so requests never wait for them. Given an
+    admission controller, a summary waits for a model call slot like a
+    question does, and is skipped (to be retried after a later turn) when
+    the queue is full.
+    """
+
+    def __init__(self, store, backend, token_budget=8000, keep_turns=6, chars_per_token=4, admission=None):
+        self.store = store
+        self.backend = backend
+        self.admission = admission
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.chars_per_token = chars_per_token
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compaction')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.compactions = 0
+
+    def needs_compaction(self, conversation_id):
+        if not self.token_budget:
+            return False
+        return self.store.size(conversation_id) / self.chars_per_token > self.token_budget
+
+    def maybe_compact(self, conversation_id):
+        """Schedule compaction for a conversation that has outgrown its budget"""
+        if not self.needs_compaction(conversation_id):
+            return None
+        with self._lock:
+            if conversation_id in self._pending:
+                return None
+            self._pending.add(conversation_id)
+        return self._executor.submit(self._compact, conversation_id)
+
+    def summarize(self, previous_summary, turns):
+        transcript = '\n\n'.join(
+            f"Student: {user_text}\nMentor: {model_text}" for user_text, model_text in turns
+        )
+        prompt = SUMMARY_PROMPT.format(
+            previous_summary=f"Summary of earlier conversation: {previous_summary}\n\n" if previous_summary else "",
+            transcript=transcript,
+        )
+        if self.admission is None:
+            return self.backend.send([], prompt).strip()
+        with self.admission.slot():
+            return self.backend.send([], prompt).strip()
+
+    def _compact(self, conversation_id):
+        try:
+            snapshot = self.store.compaction_snapshot(conversation_id, self.keep_turns)
+            if snapshot is None:
+                return False
+            previous_summary, old_turns = snapshot
+            summary = self.summarize(previous_summary, old_turns)
+            applied = self.store.apply_compaction(conversation_id, old_turns, summary)
+            if applied:
+                self.compactions += 1
+            return applied
+        except Exception as e:
+            print(f"Error compacting conversation history: {str(e)}")
+            return False
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'compactions': self.compactions,
+                'pending': len(self._pending),
+            }
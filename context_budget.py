@@ -0,0 +1,115 @@
+import re
+import threading
+from collections import OrderedDict
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate: one token per punctuation mark and per
+    four characters of each word, which tracks SentencePiece tokenizers
+    closely on English prose and code"""
+    return sum((len(piece) + 3) // 4 for piece in TOKEN_PATTERN.findall(text))
+
+
+class TokenEstimator:
+    """Counts tokens locally, optionally asking the backend for exact counts
+
+    Counts are cached by (length, hash) of the text, so large documents are
+    only scanned once and the cache does not keep the texts themselves
+    alive. Exact counts cost a network round trip on Gemini, so they are
+    only used when use_backend is set.
+    """
+
+    def __init__(self, backend=None, use_backend=False, cache_size=4096):
+        self.backend = backend
+        self.use_backend = use_backend and backend is not None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count_uncached(self, text):
+        if self.use_backend:
+            try:
+                return self.backend.count_tokens(text)
+            except Exception as e:
+                print(f"Error counting tokens with backend: {str(e)}")
+        return estimate_tokens(text)
+
+    def count(self, text):
+        if not text:
+            return 0
+        key = (len(text), hash(text))
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                return tokens
+        tokens = self._count_uncached(text)
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_history(self, history):
+        return [sum(self.count(part) for part in message["parts"]) for message in history]
+
+
+class ContextPlan:
+    """What fits in one request: the passages chosen and how many old turns to skip"""
+
+    def __init__(self, skip_turns, tokens, passages_dropped, passages=()):
+        self.skip_turns = skip_turns
+        self.tokens = tokens
+        self.passages_dropped = passages_dropped
+        self.passages = passages  # indices of the passages that fit, best first
+
+
+class ContextBudgeter:
+    """Splits a prompt token budget across system prompt, history, passages and question
+
+    The system prompt, the per-user header and the question are always sent
+    in full. Of what is left, history is guaranteed history_share, the file
+    passages may use the rest, and history can grow into any space the
+    passages do not need. Whatever does not fit is dropped lowest priority
+    first: the oldest history turns, then the lowest ranked passages.
+    """
+
+    def __init__(self, estimator, max_tokens=8000, history_share=0.25, system_prompt=''):
+        self.estimator = estimator
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.system_tokens = estimator.count(system_prompt)
+
+    def plan(self, fixed_text, history, passages=()):
+        """Fit history and passages around fixed_text (header, question, instructions)
+
+        passages are ranked best first; as many as fit are kept whole.
+        """
+        fixed_tokens = self.system_tokens + self.estimator.count(fixed_text)
+        available = max(0, self.max_tokens - fixed_tokens)
+        passage_tokens = [self.estimator.count(passage) for passage in passages]
+        turn_tokens = self.estimator.count_history(history)
+
+        # Drop the oldest turns, a user/model pair at a time, until history fits
+        history_cap = max(int(available * self.history_share), available - sum(passage_tokens))
+        history_tokens = sum(turn_tokens)
+        skip_messages = 0
+        while history_tokens > history_cap and skip_messages < len(turn_tokens):
+            history_tokens -= sum(turn_tokens[skip_messages:skip_messages + 2])
+            skip_messages += 2
+
+        passage_cap = available - history_tokens
+        chosen = []
+        used = 0
+        for index, tokens in enumerate(passage_tokens):
+            if used + tokens <= passage_cap:
+                chosen.append(index)
+                used += tokens
+        return ContextPlan(
+            skip_messages // 2,
+            fixed_tokens + history_tokens + used,
+            len(chosen) < len(passage_tokens),
+            passages=chosen,
+        )
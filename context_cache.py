@@ -0,0 +1,116 @@
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+class ContextCacheRegistry:
+    """Server-side cached copies of uploaded documents, keyed by content hash
+
+    A document is handed to the backend's context cache once, the first
+    time a question needs it, and every later question about it references
+    that handle instead of sending the document's text again. Handles live
+    for ttl seconds, matching the session idle timeout; a handle used after
+    half its ttl is extended, so it lasts as long as sessions keep asking
+    and lapses on the backend a ttl after the last question. Documents
+    under min_tokens (the backend's minimum) are not worth caching, and
+    are remembered as such, as are documents the backend failed to cache.
+    """
+
+    def __init__(self, backend, count_tokens, ttl=30 * 60, min_tokens=32768, margin=60):
+        self.backend = backend
+        self.count_tokens = count_tokens
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.margin = margin  # handles this close to expiring are treated as gone
+        self._handles = {}  # content hash -> CachedContext
+        self._uncacheable = set()
+        self._lock = threading.Lock()
+        self._creating = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.tokens_reused = 0
+
+    @property
+    def enabled(self):
+        return self.backend.supports_context_cache
+
+    def get(self, key, load_text, display_name=None):
+        """The handle for document key, creating it from load_text() if needed
+
+        Returns None if the document is too small to cache or the backend
+        could not cache it; the caller then sends the text itself.
+        """
+        if not self.enabled or key in self._uncacheable:
+            return None
+        now = time.time()
+        with self._lock:
+            cached = self._handles.get(key)
+            if cached is not None and cached.expires_at - self.margin <= now:
+                del self._handles[key]
+                cached = None
+        if cached is None:
+            cached, shared = self._creating.do(key, lambda: self._create(key, load_text, display_name))
+            if cached is None:
+                return None
+            with self._lock:
+                if shared:
+                    self.hits += 1
+                    self.tokens_reused += cached.token_count
+            return cached
+
+        if cached.expires_at - now < self.ttl / 2:
+            try:
+                self.backend.refresh_cached_context(cached, self.ttl)
+            except Exception as e:
+                print(f"Error refreshing cached context: {str(e)}")
+                self.forget(key, delete=False)
+                return self.get(key, load_text, display_name)
+        with self._lock:
+            self.hits += 1
+            self.tokens_reused += cached.token_count
+        return cached
+
+    def _create(self, key, load_text, display_name):
+        text = load_text()
+        if self.count_tokens(text) < self.min_tokens:
+            with self._lock:
+                self._uncacheable.add(key)
+            return None
+        try:
+            cached = self.backend.create_cached_context(text, self.ttl, display_name=display_name)
+        except Exception as e:
+            print(f"Error creating cached context: {str(e)}")
+            with self._lock:
+                self.failures += 1
+                self._uncacheable.add(key)
+            return None
+        with self._lock:
+            self.misses += 1
+            self._handles[key] = cached
+        return cached
+
+    def forget(self, key, delete=True):
+        """Drop the handle for a document that is no longer stored, deleting it on the backend"""
+        with self._lock:
+            cached = self._handles.pop(key, None)
+            self._uncacheable.discard(key)
+        if cached is not None and delete:
+            try:
+                self.backend.delete_cached_context(cached)
+            except Exception as e:
+                print(f"Error deleting cached context: {str(e)}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'handles': sum(1 for cached in self._handles.values() if cached.expires_at > now),
+                'hits': self.hits,
+                'misses': self.misses,
+                'failures': self.failures,
+                'tokens_reused': self.tokens_reused,
+                'ttl': self.ttl,
+            }
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Conversation:
+    """Turns of one user's chat, oldest first"""
+
+    def __init__(self):
+        self.turns = []  # list of (user_text, model_text) pairs
+        self.summary = ''  # summary of turns folded away by compaction
+        self.size = 0  # characters held by this conversation
+        self.chat = None  # live backend chat handle, created on first use
+        self.last_access = time.monotonic()
+
+    def history(self):
+        """Return the turns in the format expected by model.start_chat"""
+        messages = []
+        if self.summary:
+            # Gemini expects alternating roles, so the summary is a full turn
+            messages.append({"role": "user", "parts": [f"Summary of our conversation so far: {self.summary}"]})
+            messages.append({"role": "model", "parts": ["Got it, I'll keep that in mind."]})
+        for user_text, model_text in self.turns:
+            messages.append({"role": "user", "parts": [user_text]})
+            messages.append({"role": "model", "parts": [model_text]})
+        return messages
+
+
+class ConversationStore:
+    """Session-keyed chat history with per-session and global limits
+
+    Each conversation keeps at most max_turns question/answer pairs. Sessions
+    that have been idle for idle_timeout seconds are dropped, and when the
+    total size of all conversations passes max_total_chars the least recently
+    used conversations are evicted first.
+    """
+
+    def __init__(self, max_turns=50, idle_timeout=30 * 60, max_total_chars=20_000_000):
+        self.max_turns = max_turns
+        self.idle_timeout = idle_timeout
+        self.max_total_chars = max_total_chars
+        self._conversations = OrderedDict()
+        self._total_chars = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _touch(self, conversation_id):
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            conversation = Conversation()
+            self._conversations[conversation_id] = conversation
+        else:
+            self._conversations.move_to_end(conversation_id)
+        conversation.last_access = time.monotonic()
+        return conversation
+
+    def _remove(self, conversation_id):
+        conversation = self._conversations.pop(conversation_id, None)
+        if conversation is not None:
+            self._total_chars -= conversation.size
+        return conversation
+
+    def _evict(self):
+        # Least recently used conversations sit at the front of the dict, and
+        # the most recently used one is never evicted by its own request
+        cutoff = time.monotonic() - self.idle_timeout
+        while len(self._conversations) > 1:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_access >= cutoff and self._total_chars <= self.max_total_chars:
+                break
+            self._remove(conversation_id)
+            self.evictions += 1
+
+    def get_chat(self, conversation_id, backend):
+        """Return the live chat handle for one conversation, creating it if needed"""
+        with self._lock:
+            self._evict()
+            conversation = self._touch(conversation_id)
+            if conversation.chat is None or conversation.chat.backend is not backend:
+                conversation.chat = backend.start_chat(conversation.history())
+            return conversation.chat
+
+    def append(self, conversation_id, user_text, model_text):
+        """Record one question/answer pair, dropping the oldest turns past max_turns"""
+        with self._lock:
+            conversation = self._touch(conversation_id)
+            conversation.turns.append((user_text, model_text))
+            if conversation.chat is not None:
+                conversation.chat.record(user_text, model_text)
+            added = len(user_text) + len(model_text)
+            conversation.size += added
+            self._total_chars += added
+
+            while len(conversation.turns) > self.max_turns:
+                old_user, old_model = conversation.turns.pop(0)
+                if conversation.summary:
+                    # The chat starts with the summary turn, so rebuild it instead
+                    conversation.chat = None
+                elif conversation.chat is not None:
+                    conversation.chat.drop_oldest_turn()
+                removed = len(old_user) + len(old_model)
+                conversation.size -= removed
+                self._total_chars -= removed
+
+            self._evict()
+
+    def size(self, conversation_id):
+        """Return the number of characters stored for one conversation"""
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            return conversation.size if conversation is not None else 0
+
+    def compaction_snapshot(self, conversation_id, keep_turns):
+        """Return the current summary and the turns older than the last keep_turns
+
+        Returns None when there is nothing to fold away.
+        """
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None or len(conversation.turns) <= keep_turns:
+                return None
+            return conversation.summary, conversation.turns[:len(conversation.turns) - keep_turns]
+
+    def apply_compaction(self, conversation_id, old_turns, summary):
+        """Replace old_turns with summary if they are still the oldest turns stored
+
+        The summary is made off the request path, so the conversation may have
+        been reset or trimmed in the meantime; in that case nothing changes.
+        """
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                return False
+            count = len(old_turns)
+            if len(conversation.turns) < count or any(
+                stored is not old for stored, old in zip(conversation.turns, old_turns)
+            ):
+                return False
+
+            removed = len(conversation.summary) + sum(len(u) + len(m) for u, m in old_turns)
+            del conversation.turns[:count]
+            conversation.summary = summary
+            conversation.size += len(summary) - removed
+            self._total_chars += len(summary) - removed
+            # The live chat still holds the old turns; it is rebuilt on next use
+            conversation.chat = None
+            return True
+
+    def reset(self, conversation_id):
+        """Forget everything stored for one conversation"""
+        with self._lock:
+            self._remove(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'conversations': len(self._conversations),
+                'total_chars': self._total_chars,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,111 @@
+import mmap
+import os
+import shutil
+import tempfile
+
+
+def default_spill_dir(upload_folder):
+    """Spill directory under the upload folder, or on tmpfs when there is none"""
+    if upload_folder:
+        return os.path.join(upload_folder, 'document_cache')
+    # Production (e.g. Vercel) has no upload folder; prefer RAM-backed tmpfs
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return os.path.join('/dev/shm', 'chatbot_documents')
+    return os.path.join(tempfile.gettempdir(), 'chatbot_documents')
+
+
+class MappedFile:
+    """Read-only memory map of a spilled file
+
+    Reads go straight to the page cache; only the requested slice is ever
+    turned into a Python object.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap cannot map an empty file
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def read_text(self, start=0, end=None):
+        """Decode a UTF-8 byte range without copying the rest of the file"""
+        if self._map is None:
+            return ''
+        with memoryview(self._map) as view:
+            return str(view[start:end], 'utf-8')
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class DocumentStore:
+    """Keeps small documents in memory and spills large ones to disk
+
+    When an upload's raw bytes or extracted text reach spill_threshold, the
+    text and the passage texts are written to a directory of their own and
+    read back through mmap, so a large upload costs page cache instead of
+    Python heap. The raw file is moved there too, off the spool, but is not
+    mapped since nothing reads it again.
+    """
+
+    def __init__(self, directory, spill_threshold=1024 * 1024):
+        self.directory = directory
+        self.spill_threshold = spill_threshold
+        os.makedirs(directory, exist_ok=True)
+        self.spilled = 0
+        self.removed = 0
+
+    def should_spill(self, file_size, document):
+        return file_size >= self.spill_threshold or len(document.text) >= self.spill_threshold
+
+    def _write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+        return MappedFile(path)
+
+    def spill(self, key, document, index, raw_path):
+        """Move a document's raw file, text and passages to disk
+
+        raw_path is a spooled upload; it is moved, not copied, into the
+        spill directory. Returns the spill directory.
+        """
+        # A directory per spill, so a re-upload never writes into files still being removed
+        directory = tempfile.mkdtemp(prefix=f"{key[:16]}-", dir=self.directory)
+        shutil.move(raw_path, os.path.join(directory, 'raw'))
+        document.spill(self._write(os.path.join(directory, 'text'), document.text.encode('utf-8')))
+
+        # Passages overlap, so they are stored back to back rather than sliced from the text
+        encoded = [passage.text.encode('utf-8') for passage in index.passages]
+        passages_file = self._write(os.path.join(directory, 'passages'), b''.join(encoded))
+        position = 0
+        for passage, data in zip(index.passages, encoded):
+            passage.spill(passages_file, position, position + len(data))
+            position += len(data)
+
+        self.spilled += 1
+        return directory
+
+    def remove(self, directory):
+        """Delete a spill directory
+
+        The maps are not closed here: a request may still be reading the
+        entry, and an unlinked file stays readable until its last map is
+        garbage collected.
+        """
+        shutil.rmtree(directory, ignore_errors=True)
+        self.removed += 1
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'spill_threshold': self.spill_threshold,
+            'spilled': self.spilled,
+            'removed': self.removed,
+        }
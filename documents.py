@@ -0,0 +1,268 @@
+import bisect
+import hashlib
+import re
+import sys
+from io import BytesIO
+
+try:
+    import PyPDF2
+    from docx import Document
+except ImportError:
+    print("Warning: PyPDF2 or python-docx not installed. PDF/DOC support will be limited to text files only.")
+    # Provide fallback for file reading
+    PyPDF2 = None
+    Document = None
+
+SPACES = re.compile(r'[ \t\f\v\u00a0]+')
+TRAILING_SPACES = re.compile(r' +\n')
+BLANK_LINES = re.compile(r'\n{3,}')
+
+
+class DocumentError(Exception):
+    """Raised when an uploaded file cannot be turned into text"""
+
+
+def normalize_text(text):
+    """Normalize line endings and whitespace so documents index and hash consistently"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    text = SPACES.sub(' ', text)
+    text = TRAILING_SPACES.sub('\n', text)
+    return BLANK_LINES.sub('\n\n', text).strip()
+
+
+class ExtractedDocument:
+    """Text of an uploaded file, parsed once at upload time
+
+    offsets[i] is where segment i (a PDF page, a DOCX paragraph or the whole
+    text file) starts in text, so positions in the text can be mapped back
+    to pages or paragraphs. Once spilled, the text lives in a memory-mapped
+    file and is decoded only when read.
+    """
+
+    def __init__(self, filename, text, offsets, segment_kind, content_hash):
+        self.filename = filename
+        self._text = text
+        self.text_source = None
+        self.offsets = offsets
+        self.segment_kind = segment_kind
+        self.content_hash = content_hash
+
+    @property
+    def text(self):
+        if self._text is None:
+            return self.text_source.read_text()
+        return self._text
+
+    def spill(self, source):
+        """Read the text from source (a MappedFile of its UTF-8 bytes) from now on"""
+        self.text_source = source
+        self._text = None
+
+    @property
+    def nbytes(self):
+        """Approximate heap memory held by the text and offsets"""
+        text_bytes = sys.getsizeof(self._text) if self._text is not None else 0
+        return text_bytes + 8 * len(self.offsets)
+
+    @property
+    def segment_count(self):
+        return len(self.offsets)
+
+    def segment_at(self, position):
+        """Return the index of the page or paragraph containing a text position"""
+        return max(0, bisect.bisect_right(self.offsets, position) - 1)
+
+
+class PdfDocument(ExtractedDocument):
+    """A PDF whose pages are extracted on demand
+
+    Starts with only a page count; add_pages fills in page texts as they
+    are extracted, in any order. text and offsets cover the pages seen so
+    far (missing pages are empty), so the retrieval layer can use it like
+    any other document while the rest is still being read.
+    """
+
+    def __init__(self, filename, page_count, content_hash):
+        super().__init__(filename, None, [], 'page', content_hash)
+        self.page_count = page_count
+        self._pages = [None] * page_count
+        self.pages_extracted = 0
+
+    def add_pages(self, page_texts):
+        """Store extracted page texts ({page index: text}); returns the newly added indices"""
+        added = []
+        for page, text in page_texts.items():
+            if self._pages[page] is None:
+                self._pages[page] = text
+                added.append(page)
+        if added:
+            self._offsets = None
+        self.pages_extracted += len(added)
+        return sorted(added)
+
+    # spill() swaps _pages for None while questions may be reading, so every
+    # reader takes one reference to it; text_source is set before the swap
+    def has_page(self, page):
+        pages = self._pages
+        if pages is None:
+            # Only complete documents are spilled
+            return 0 <= page < self.page_count
+        return 0 <= page < self.page_count and pages[page] is not None
+
+    def page_text(self, page):
+        """Text of one page, or None if it has not been extracted yet"""
+        pages = self._pages
+        if pages is None:
+            offsets = self.offsets
+            text = self.text_source.read_text()
+            end = offsets[page + 1] - 1 if page + 1 < len(offsets) else len(text)
+            return text[offsets[page]:end]
+        return pages[page]
+
+    @property
+    def complete(self):
+        return self.pages_extracted == self.page_count
+
+    @property
+    def text(self):
+        pages = self._pages
+        if pages is None:
+            return self.text_source.read_text()
+        return '\n'.join(page or '' for page in pages)
+
+    @property
+    def offsets(self):
+        offsets = self._offsets
+        if offsets is None:
+            pages = self._pages
+            if pages is None:
+                # Spilled since _offsets was read; spill sets them first
+                return self._offsets
+            offsets, position = [], 0
+            for page in pages:
+                offsets.append(position)
+                position += len(page or '') + 1
+            self._offsets = offsets
+        return offsets
+
+    @offsets.setter
+    def offsets(self, value):
+        self._offsets = value or None
+
+    def spill(self, source):
+        self._offsets = self.offsets
+        super().spill(source)
+        self._pages = None
+
+    @property
+    def nbytes(self):
+        pages = self._pages or ()
+        return sum(sys.getsizeof(page) for page in pages if page is not None) + 8 * self.page_count
+
+
+def file_extension(filename):
+    return filename.lower().split('.')[-1]
+
+
+def open_source(source):
+    """Open file bytes or a path to a spooled upload as a binary stream"""
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    return open(source, 'rb')
+
+
+def hash_source(source):
+    """SHA-256 of file bytes or of a file on disk, read in chunks"""
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_segments(source, filename):
+    """Return the raw text segments of a file and what kind of segment they are
+
+    source is the file's bytes or the path of a file on disk; PDF and DOCX
+    files are read from disk as the parser needs them.
+    """
+    extension = file_extension(filename)
+
+    if extension == 'txt':
+        with open_source(source) as f:
+            return [f.read().decode('utf-8')], 'section'
+
+    if extension == 'pdf':
+        if PyPDF2 is None:
+            raise DocumentError("PDF support not available. Please install PyPDF2.")
+        with open_source(source) as f:
+            pdf_reader = PyPDF2.PdfReader(f)
+            return [page.extract_text() or '' for page in pdf_reader.pages], 'page'
+
+    if extension in ['doc', 'docx']:
+        if Document is None:
+            raise DocumentError("DOC/DOCX support not available. Please install python-docx.")
+        with open_source(source) as f:
+            doc = Document(f)
+        return [paragraph.text for paragraph in doc.paragraphs], 'paragraph'
+
+    raise DocumentError("Unsupported file format")
+
+
+def pdf_page_count(source):
+    """Number of pages in a PDF, without extracting any text"""
+    if PyPDF2 is None:
+        raise DocumentError("PDF support not available. Please install PyPDF2.")
+    try:
+        with open_source(source) as f:
+            return len(PyPDF2.PdfReader(f).pages)
+    except Exception as e:
+        print(f"Error reading PDF: {str(e)}")
+        raise DocumentError(f"Error reading file: {str(e)}")
+
+
+def extract_pdf_pages(source, pages):
+    """Extract and normalize the text of some pages of a PDF, as {page index: text}"""
+    try:
+        with open_source(source) as f:
+            pdf_reader = PyPDF2.PdfReader(f)
+            return {page: normalize_text(pdf_reader.pages[page].extract_text() or '') for page in pages}
+    except Exception as e:
+        print(f"Error reading PDF pages: {str(e)}")
+        raise DocumentError(f"Error reading file: {str(e)}")
+
+
+def extract_document(source, filename, content_hash=None):
+    """Parse an uploaded file into normalized text with segment offsets and a content hash
+
+    Pass content_hash when it is already known (e.g. computed while the
+    upload was spooled) to skip reading the file a second time.
+    """
+    try:
+        segments, segment_kind = extract_segments(source, filename)
+    except DocumentError:
+        raise
+    except Exception as e:
+        print(f"Error reading file {filename}: {str(e)}")
+        raise DocumentError(f"Error reading file: {str(e)}")
+
+    parts = []
+    offsets = []
+    position = 0
+    for segment in segments:
+        segment = normalize_text(segment)
+        if not segment and segment_kind == 'paragraph':
+            continue  # empty DOCX paragraphs are only spacing
+        offsets.append(position)
+        parts.append(segment)
+        position += len(segment) + 1  # parts are joined with a newline
+
+    return ExtractedDocument(
+        filename=filename,
+        text='\n'.join(parts),
+        offsets=offsets,
+        segment_kind=segment_kind,
+        content_hash=content_hash or hash_source(source),
+    )
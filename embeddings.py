@@ -0,0 +1,55 @@
+import re
+import zlib
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+class HashingEmbedder:
+    """Offline text embedder built from hashed word and character n-grams
+
+    Every word and every character n-gram inside a word is hashed into one
+    of dim buckets, with a hash-derived sign so collisions tend to cancel.
+    Vectors are L2 normalized, so a dot product is the cosine similarity.
+    No model download or network access is needed and the output is stable
+    across processes, which makes the vectors safe to persist.
+    """
+
+    def __init__(self, dim=512, ngram_range=(3, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    @property
+    def signature(self):
+        """Identifies the vector space, for keying saved vectors"""
+        return f"hashing-{self.dim}-{self.ngram_range[0]}-{self.ngram_range[1]}"
+
+    def features(self, text):
+        """Return the list of string features hashed for text"""
+        words = WORD_PATTERN.findall(text.lower())
+        features = list(words)
+        low, high = self.ngram_range
+        for word in words:
+            padded = f"<{word}>"
+            for n in range(low, high + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def _fill(self, row, text):
+        for feature in self.features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            row[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+
+    def embed(self, text):
+        """Embed one text as a float32 vector of length dim"""
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts):
+        """Embed several texts into a (len(texts), dim) float32 matrix"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(matrix, texts):
+            self._fill(row, text)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
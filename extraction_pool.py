@@ -0,0 +1,177 @@
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; workers then run without a memory limit
+    resource = None
+
+from documents import DocumentError, extract_document, extract_pdf_pages, file_extension, pdf_page_count
+
+
+class ExtractionTimeout(DocumentError):
+    """Raised when a document takes longer than the per-file limit to parse"""
+
+
+class _Deadline(BaseException):
+    """Raised in a worker by its alarm; not an Exception, so parsers cannot swallow it"""
+
+
+# How long past its limit a task may keep a worker before the parent kills the pool;
+# only a parser stuck in C code, which the worker's alarm cannot interrupt, gets that far
+STUCK_GRACE = 5.0
+
+
+def current_address_space():
+    """Virtual memory size of this process in bytes, or 0 if unknown"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def limit_worker_memory(memory_limit):
+    """Pool initializer: cap how much more memory a worker may allocate"""
+    if resource is None or not memory_limit:
+        return
+    limit = current_address_space() + memory_limit
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"Could not limit extraction worker memory: {str(e)}")
+
+
+def _alarm(signum, frame):
+    raise _Deadline()
+
+
+def run_with_deadline(timeout, fn, *args):
+    """Worker side of a task: fn(*args), interrupted once it has run for timeout seconds
+
+    The clock starts when the worker picks the task up, so time spent
+    waiting behind other files does not count against this one.
+    """
+    if not hasattr(signal, 'setitimer'):
+        return fn(*args)
+    signal.signal(signal.SIGALRM, _alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    except _Deadline:
+        raise ExtractionTimeout() from None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ExtractionPool:
+    """Parses PDF and DOCX uploads in worker processes
+
+    PyPDF2 and python-docx are pure Python and hold the GIL, so parsing in
+    a separate process keeps request threads responsive and lets several
+    uploads use several cores. Each file (or batch of PDF pages) gets
+    timeout seconds of wall-clock time from when a worker starts on it, and
+    workers may allocate at most memory_limit bytes. At most max_pending
+    files (by default one per worker) are handed to the pool at once, so
+    none waits inside it; a worker that cannot be interrupted is killed
+    and the pool is recreated. Plain text files are cheap to decode and
+    are handled in-process. With max_workers=0 everything runs in-process.
+    """
+
+    def __init__(self, max_workers=2, timeout=30.0, memory_limit=512 * 1024 * 1024, max_pending=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending or max(1, max_workers))
+        self.timeouts = 0
+        self.crashes = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Forking this process could copy locks held by its other threads into the
+                # worker; a forkserver forks workers from a clean single-threaded process
+                # that has only the parsing code loaded. Each worker still imports the main
+                # script as __mp_main__: cheap for gunicorn, uvicorn or flask run, but
+                # `python app.py` runs all of app.py's setup again in every worker
+                context = None
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(['documents'])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=limit_worker_memory,
+                    initargs=(self.memory_limit,),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """Kill every worker of a pool that has a stuck or dead task"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, source, filename, content_hash=None):
+        """Extract a document, raising DocumentError (or ExtractionTimeout) on failure
+
+        source is the file's bytes or the path of a spooled upload; a path
+        is all a worker needs, so large files are not pickled across.
+        """
+        if not self.max_workers or file_extension(filename) == 'txt':
+            return extract_document(source, filename, content_hash)
+        return self._run(filename, extract_document, source, filename, content_hash)
+
+    def page_count(self, source, filename):
+        """Number of pages in a PDF"""
+        if not self.max_workers:
+            return pdf_page_count(source)
+        return self._run(filename, pdf_page_count, source)
+
+    def extract_pages(self, source, filename, pages):
+        """Text of some pages of a PDF, as {page index: text}"""
+        if not self.max_workers:
+            return extract_pdf_pages(source, pages)
+        return self._run(filename, extract_pdf_pages, source, pages)
+
+    def _run(self, filename, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ExtractionTimeout("Too many documents are being processed, please try again shortly")
+        try:
+            # A second attempt covers tasks lost when another file's stuck worker was killed
+            for attempt in range(2):
+                executor = self._get_executor()
+                future = executor.submit(run_with_deadline, self.timeout, fn, *args)
+                try:
+                    return future.result(timeout=self.timeout + STUCK_GRACE)
+                except ExtractionTimeout:
+                    self.timeouts += 1
+                    raise ExtractionTimeout(f"Reading {filename} took longer than {self.timeout:g} seconds")
+                except TimeoutError:
+                    self.timeouts += 1
+                    self._discard_executor(executor)
+                    raise ExtractionTimeout(f"Reading {filename} took longer than {self.timeout:g} seconds")
+                except BrokenProcessPool:
+                    self._discard_executor(executor)
+            self.crashes += 1
+            raise DocumentError(f"Reading {filename} crashed the document reader")
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'timeouts': self.timeouts,
+            'crashes': self.crashes,
+        }
@@ -0,0 +1,158 @@
+import numpy as np
+
+from embeddings import HashingEmbedder
+
+# Questions that need the uploaded document, and questions that do not
+SEED_EXAMPLES = [
+    ("what does the document say about this", 1),
+    ("what does chapter 3 say", 1),
+    ("summarize the file", 1),
+    ("summarize chapter 2", 1),
+    ("give me a summary of the uploaded notes", 1),
+    ("what is on page 12", 1),
+    ("explain the second section", 1),
+    ("what are the main points of the lecture notes", 1),
+    ("according to the text, why did it happen", 1),
+    ("what does the author argue", 1),
+    ("list the key terms from the reading", 1),
+    ("quiz me on this material", 1),
+    ("make flashcards from my notes", 1),
+    ("what is the conclusion of the paper", 1),
+    ("what does the textbook say about mitochondria", 1),
+    ("compare the notes with the textbook", 1),
+    ("find where the pdf mentions photosynthesis", 1),
+    ("in the slides, what is the definition given", 1),
+    ("what is the first exercise in the worksheet", 1),
+    ("explain the table in the appendix", 1),
+    ("what is the main idea of this chapter", 1),
+    ("based on the content, answer question 4", 1),
+    ("read the introduction and explain it", 1),
+    ("what examples does the handout use", 1),
+    ("what does it say about respiration", 1),
+    ("what are the key points", 1),
+    ("explain section 4 of the notes", 1),
+    ("summarize this", 1),
+    ("what is this document about", 1),
+    ("what is the file about", 1),
+    ("go through the questions in the assignment", 1),
+    ("what formula is used in the example on page 5", 1),
+    ("who are the characters in the story", 1),
+    ("what dates are mentioned in the reading", 1),
+    ("does the article mention climate change", 1),
+    ("what did the lecture cover", 1),
+    ("explain the diagram in figure 2", 1),
+    ("what are the learning objectives listed", 1),
+    ("what does paragraph 3 mean", 1),
+    ("can you simplify the explanation in this text", 1),
+    ("what are the steps described in the lab manual", 1),
+    ("which experiment does the report describe", 1),
+    ("what is the thesis statement of the essay", 1),
+    ("pick out the important definitions", 1),
+    ("how do I read input in C", 0),
+    ("what is the capital of france", 0),
+    ("tell me a joke", 0),
+    ("hello how are you", 0),
+    ("what is 12 times 7", 0),
+    ("how do I write a for loop in python", 0),
+    ("explain recursion with an example", 0),
+    ("what is a pointer in c", 0),
+    ("how do I read a file in java", 0),
+    ("can you help me with my homework", 0),
+    ("what is the difference between a list and a tuple", 0),
+    ("write a poem about the ocean", 0),
+    ("what time is it in tokyo", 0),
+    ("how does photosynthesis work in general", 0),
+    ("what is your name", 0),
+    ("translate good morning to spanish", 0),
+    ("how do I center a div", 0),
+    ("what is the speed of light", 0),
+    ("give me study tips for exams", 0),
+    ("thank you", 0),
+    ("how do I sort an array in javascript", 0),
+    ("what is machine learning", 0),
+    ("how can I improve my handwriting", 0),
+    ("what text editor should I use for coding", 0),
+    ("what's the weather like today", 0),
+    ("who won the world cup", 0),
+    ("who is the president of the united states", 0),
+    ("what is the tallest mountain in the world", 0),
+    ("recommend a good movie", 0),
+    ("how many planets are in the solar system", 0),
+    ("what year did world war two end", 0),
+    ("what is the boiling point of water", 0),
+    ("who invented the telephone", 0),
+    ("how do I make pancakes", 0),
+    ("what should I eat for dinner", 0),
+    ("what is the meaning of life", 0),
+    ("how old is the universe", 0),
+    ("what does http stand for", 0),
+    ("how do I install python on windows", 0),
+    ("what is a black hole", 0),
+    ("how do vaccines work", 0),
+    ("can you recommend a book to read", 0),
+    ("what is the best programming language", 0),
+    ("how do I stay motivated while studying", 0),
+    ("who painted the mona lisa", 0),
+]
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class IntentClassifier:
+    """Decides whether a question needs the session's uploaded documents
+
+    A logistic regression over hashed word and character n-gram features
+    scores how much the question is phrased as being about a document
+    ("what does chapter 3 say"). That is combined with how well the
+    documents cover the question's terms, either of which can make the
+    document relevant, so "how do I read input in C" gets a C textbook
+    attached but not a biology handout. Scoring one question is a dot
+    product over a few dozen features and a few dictionary lookups.
+    """
+
+    def __init__(self, embedder, weights, bias, threshold=0.6, similarity_weight=0.9):
+        self.embedder = embedder
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+        self.similarity_weight = similarity_weight
+        self.checked = 0
+        self.attached = 0
+
+    @classmethod
+    def train(cls, examples=SEED_EXAMPLES, dim=512, steps=1000, learning_rate=2.0, l2=1e-3, **kwargs):
+        """Fit the linear model with batch gradient descent on (question, label) pairs"""
+        embedder = HashingEmbedder(dim=dim)
+        features = embedder.embed_batch([text for text, label in examples])
+        labels = np.array([label for text, label in examples], dtype=np.float32)
+        weights = np.zeros(dim, dtype=np.float32)
+        bias = 0.0
+        for _ in range(steps):
+            error = sigmoid(features @ weights + bias) - labels
+            weights -= learning_rate * (features.T @ error / len(labels) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        return cls(embedder, weights, bias, **kwargs)
+
+    def intent(self, question):
+        """Probability that the question is phrased as being about a document"""
+        return float(sigmoid(self.embedder.embed(question) @ self.weights + self.bias))
+
+    def score(self, question, corpus):
+        """Probability that either the intent or corpus (a CorpusIndex) coverage makes the document relevant"""
+        similarity = corpus.coverage(question) if corpus is not None else 0.0
+        return 1 - (1 - self.intent(question)) * (1 - self.similarity_weight * similarity)
+
+    def wants_document(self, question, corpus):
+        self.checked += 1
+        relevant = self.score(question, corpus) >= self.threshold
+        self.attached += relevant
+        return relevant
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'attached': self.attached,
+            'threshold': self.threshold,
+        }
@@ -0,0 +1,116 @@
+import os
+import threading
+
+from documents import DocumentError
+from retrieval import chunk_pages
+
+
+class PageLoader:
+    """Reads a PDF into its document and index a batch of pages at a time
+
+    The first batch is read by load_first_batch before the upload returns,
+    the rest by a background thread (start) in page order, so a question
+    can be answered from the pages read so far. ensure reads specific pages
+    straight away, for questions that name a page. Extraction runs in the
+    pool's worker processes; on_progress is called after every batch and
+    on_complete once every page has been read.
+
+    The loader owns the spooled PDF at path and deletes it when it is done
+    or cancelled, unless take_path handed it over first.
+    """
+
+    def __init__(self, pool, path, document, index, batch_pages=16, chunk_chars=1000, overlap=150,
+                 on_progress=None, on_complete=None):
+        self.pool = pool
+        self.path = path
+        self.document = document
+        self.index = index
+        self.batch_pages = batch_pages
+        self.chunk_chars = chunk_chars
+        self.overlap = overlap
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def _missing(self, pages):
+        return [page for page in pages if not self.document.has_page(page)]
+
+    def _read(self, pages):
+        """Extract pages that are still missing and index them"""
+        pages = self._missing(pages)
+        path = self.path
+        if not pages or path is None or self._cancelled.is_set():
+            return
+        texts = self.pool.extract_pages(path, self.document.filename, pages)
+        # Batches and on-demand pages may race; only the first copy of a page is indexed
+        with self._lock:
+            added = self.document.add_pages(texts)
+            self.index.add(chunk_pages(self.document, added, self.chunk_chars, self.overlap))
+        if added and self.on_progress is not None:
+            self.on_progress(self)
+
+    def load_first_batch(self):
+        """Read the first batch of pages; errors are raised to the uploader"""
+        try:
+            self._read(range(min(self.batch_pages, self.document.page_count)))
+        except Exception:
+            self._release_path()
+            raise
+
+    def start(self):
+        """Read the remaining pages in the background"""
+        if self.document.complete:
+            self._finish()
+            return
+        self._thread = threading.Thread(target=self._run, name='page-loader', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for first in range(0, self.document.page_count, self.batch_pages):
+                if self._cancelled.is_set():
+                    return
+                self._read(range(first, min(first + self.batch_pages, self.document.page_count)))
+            self._finish()
+        except Exception as e:
+            # Keep answering from the pages that were read
+            print(f"Error reading {self.document.filename}: {str(e)}")
+        finally:
+            self._release_path()
+
+    def _finish(self):
+        if self.on_complete is not None and not self._cancelled.is_set():
+            self.on_complete(self)
+        self._release_path()
+
+    def ensure(self, pages):
+        """Read the given page indices now if they have not been read yet"""
+        pages = [page for page in pages if 0 <= page < self.document.page_count]
+        if self.path is None or not self._missing(pages):
+            return
+        try:
+            self._read(pages)
+        except DocumentError as e:
+            print(f"Error reading pages of {self.document.filename}: {str(e)}")
+
+    def cancel(self):
+        """Stop reading; the spooled file is deleted once the current batch ends"""
+        self._cancelled.set()
+        if self._thread is None or not self._thread.is_alive():
+            self._release_path()
+
+    def take_path(self):
+        """Hand the spooled PDF over to the caller, who then owns it"""
+        with self._lock:
+            path, self.path = self.path, None
+            return path
+
+    def _release_path(self):
+        path = self.take_path()
+        if path is not None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,98 @@
+import threading
+
+
+def header(user_name, user_age):
+    return f"Context: You are talking to {user_name}, who is {user_age} years old.\n\n"
+
+
+def question_prompt(prefix, question):
+    return f"{prefix}User Question: {question}"
+
+
+def file_question_prompt(prefix, file_content, question):
+    return (
+        f"{prefix}File Content (most relevant excerpts): {file_content}\n\n"
+        f"User Question: {question}\n\n"
+        "Instructions: Please answer the question using the provided file content. "
+        "Each excerpt starts with the document it came from; cite it when you use it."
+    )
+
+
+def cached_file_question_prompt(prefix, document, other_excerpts, question):
+    """The document itself is in the backend's context cache; other files still come as excerpts"""
+    return (
+        f"{prefix}File Content: the full text of {document} is provided above, "
+        f"each page or paragraph marked with its number.{other_excerpts}\n\n"
+        f"User Question: {question}\n\n"
+        "Instructions: Please answer the question using the provided file content. "
+        "Cite the document (and page or paragraph) you use."
+    )
+
+
+def other_excerpts(file_content):
+    return f"\n\nMost relevant excerpts of the other files: {file_content}"
+
+
+class PromptBuilder:
+    """Assembles the prompt for each question from the functions above
+
+    The per-user header only changes when the user does, so it is rendered
+    once per session and kept for the max_prefixes most recently started
+    sessions. Reading a cached prefix takes no lock.
+    """
+
+    def __init__(self, max_prefixes=10000):
+        self.max_prefixes = max_prefixes
+        self._prefixes = {}  # session id -> (user name, user age, prefix), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prefix(self, session_id, user_name, user_age):
+        """The static start of every prompt for this session's user"""
+        cached = self._prefixes.get(session_id)
+        if cached is not None and cached[0] == user_name and cached[1] == user_age:
+            self.hits += 1
+            return cached[2]
+        prefix = header(user_name, user_age)
+        with self._lock:
+            self.misses += 1
+            self._prefixes.pop(session_id, None)
+            self._prefixes[session_id] = (user_name, user_age, prefix)
+            # A prefix is cheap to render again, so the oldest sessions simply go first
+            while len(self._prefixes) > self.max_prefixes:
+                del self._prefixes[next(iter(self._prefixes))]
+        return prefix
+
+    def forget(self, session_id):
+        """Drop the cached prefix of a session that was reset"""
+        with self._lock:
+            self._prefixes.pop(session_id, None)
+
+    def build(self, prefix, question, file_content='', cached_document=None):
+        """The full prompt; file_content switches to the template with excerpts
+
+        cached_document names a document the model reads from a cached
+        context; file_content then holds excerpts of any other files.
+        """
+        if cached_document is not None:
+            if file_content:
+                file_content = other_excerpts(file_content)
+            return cached_file_question_prompt(prefix, cached_document, file_content, question)
+        if file_content:
+            return file_question_prompt(prefix, file_content, question)
+        return question_prompt(prefix, question)
+
+    def frame(self, prefix, question, cached_document=None):
+        """The prompt with excerpts but without their text, for budgeting what fits"""
+        if cached_document is not None:
+            return cached_file_question_prompt(prefix, cached_document, other_excerpts(''), question)
+        return file_question_prompt(prefix, '', question)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'prefixes': len(self._prefixes),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,241 @@
+import heapq
+import math
+import re
+import sys
+import threading
+from collections import Counter
+
+TERM_PATTERN = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its
+me my of on or so than that the their them then there these they this to was we were
+what when where which who why will with you your about please tell explain
+""".split())
+
+
+def tokenize(text):
+    """Lowercased word terms with stopwords removed"""
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class Passage:
+    """A chunk of a document and where it came from
+
+    A spilled passage keeps only the byte range of its text in a
+    memory-mapped file.
+    """
+
+    __slots__ = ('_text', 'source', 'span', 'start', 'segment')
+
+    def __init__(self, text, start, segment):
+        self._text = text
+        self.source = None
+        self.span = None
+        self.start = start  # character offset in the document text (in the page, for chunk_pages)
+        self.segment = segment  # page or paragraph index the chunk starts in
+
+    @property
+    def text(self):
+        if self._text is None:
+            return self.source.read_text(*self.span)
+        return self._text
+
+    def spill(self, source, begin, end):
+        """Read the text from bytes begin:end of source from now on"""
+        self.source = source
+        self.span = (begin, end)
+        self._text = None
+
+    @property
+    def nbytes(self):
+        text_bytes = sys.getsizeof(self._text) if self._text is not None else 0
+        return text_bytes + 100
+
+
+def split_text(text, chunk_chars=1000, overlap=150):
+    """Yield (start, chunk) pairs of overlapping chunks ending on word boundaries"""
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            boundary = text.rfind(' ', start + chunk_chars // 2, end)
+            if boundary != -1:
+                end = boundary
+        chunk = text[start:end].strip()
+        if chunk:
+            yield start, chunk
+        if end >= len(text):
+            break
+        next_start = max(start + 1, end - overlap)
+        # Start the overlap at a word boundary too
+        space = text.find(' ', next_start, end)
+        start = space + 1 if space != -1 else next_start
+
+
+def chunk_document(document, chunk_chars=1000, overlap=150):
+    """Split a document's text into overlapping passages ending on word boundaries"""
+    return [
+        Passage(chunk, start, document.segment_at(start))
+        for start, chunk in split_text(document.text, chunk_chars, overlap)
+    ]
+
+
+def chunk_pages(document, pages, chunk_chars=1000, overlap=150):
+    """Split some pages of a PdfDocument into passages that never cross a page
+
+    Pages can arrive in any order, so start is the offset within the page;
+    (segment, start) still orders passages as they appear in the document.
+    """
+    return [
+        Passage(chunk, start, page)
+        for page in pages
+        for start, chunk in split_text(document.page_text(page), chunk_chars, overlap)
+    ]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over the passages of a document
+
+    Built once per document, or grown with add while a document is still
+    being read; a search only touches the postings of the query's terms.
+    """
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = []
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {passage index: term frequency}
+        self.lengths = []
+        self.total_length = 0
+        self.average_length = 0.0
+        self._lock = threading.Lock()
+        self.add(passages)
+
+    def add(self, passages):
+        """Index more passages; they get the next passage indices"""
+        with self._lock:
+            for passage in passages:
+                index = len(self.passages)
+                terms = Counter(tokenize(passage.text))
+                self.lengths.append(sum(terms.values()))
+                self.total_length += self.lengths[-1]
+                for term, frequency in terms.items():
+                    self.postings.setdefault(term, {})[index] = frequency
+                self.passages.append(passage)
+            self.average_length = self.total_length / len(self.lengths) if self.lengths else 0.0
+
+    @property
+    def nbytes(self):
+        """Approximate heap memory held by the passages and postings"""
+        # A document still being read grows its index from other threads
+        with self._lock:
+            passage_bytes = sum(passage.nbytes for passage in self.passages)
+            # A posting is a dict slot plus a small int; terms cost their string and dict
+            posting_bytes = sum(100 + 50 * len(postings) for postings in self.postings.values())
+        return passage_bytes + posting_bytes
+
+    def document_frequency(self, term):
+        return len(self.postings.get(term, ()))
+
+    def idf(self, term):
+        return bm25_idf(len(self.passages), self.document_frequency(term))
+
+    def search(self, query, k=8):
+        """Return up to k (score, passage) pairs, best first; empty if no term matches"""
+        return [(score, self.passages[row]) for score, row in self.rank(query, k)]
+
+    def rank(self, query, k=8):
+        """Return up to k (score, passage index) pairs, best first"""
+        scores = {}
+        with self._lock:
+            term_idfs = [(term, self.idf(term)) for term in set(tokenize(query))]
+            self.accumulate(term_idfs, self.average_length, scores)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, index) for index, score in best]
+
+    def accumulate(self, term_idfs, average_length, scores, tag=None):
+        """Add the BM25 scores of this index's passages to scores
+
+        idf and average length are passed in so several indexes can be
+        scored with the statistics of their union. Keys are passage indices,
+        or (tag, passage index) when a tag is given.
+        """
+        for term, idf in term_idfs:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            for index, frequency in postings.items():
+                key = index if tag is None else (tag, index)
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+
+class CorpusIndex:
+    """BM25 over the indexes of several documents as if they were one
+
+    Document frequencies and lengths are summed over the member indexes at
+    query time, so scores are comparable across documents. A corpus is
+    made for each question from the session's documents; the per-document
+    indexes (which uploads of the same file share) are never rebuilt.
+    """
+
+    def __init__(self, members=()):
+        self.members = dict(members)  # tag -> BM25Index
+
+    def rank(self, query, k=8):
+        """Return up to k (score, (tag, passage index)) pairs, best first"""
+        members = list(self.members.items())
+        count = sum(len(index.passages) for tag, index in members)
+        if not count:
+            return []
+        average_length = sum(index.total_length for tag, index in members) / count
+        term_idfs = []
+        for term in set(tokenize(query)):
+            frequency = sum(index.document_frequency(term) for tag, index in members)
+            if frequency:
+                term_idfs.append((term, bm25_idf(count, frequency)))
+        scores = {}
+        for tag, index in members:
+            with index._lock:
+                index.accumulate(term_idfs, average_length, scores, tag)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, key) for key, score in best]
+
+    def coverage(self, query):
+        """Share of the query's terms (weighted by idf) that occur in the corpus, from 0 to 1
+
+        Rare terms the documents contain count most; a term they never use
+        counts against the match with the highest possible weight.
+        """
+        members = list(self.members.values())
+        count = sum(len(index.passages) for index in members)
+        terms = set(tokenize(query))
+        if not count or not terms:
+            return 0.0
+        found = total = 0.0
+        for term in terms:
+            frequency = sum(index.document_frequency(term) for index in members)
+            weight = bm25_idf(count, frequency)
+            total += weight
+            if frequency:
+                found += weight
+        return found / total
+
+
+def bm25_idf(count, frequency):
+    """Inverse document frequency of a term found in frequency of count passages"""
+    return math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge several best-first lists of passage indices (or other keys) into one
+
+    Each list contributes 1 / (k + rank) per passage, so passages ranked
+    well by both keyword and vector search come first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,135 @@
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from embeddings import WORD_PATTERN, HashingEmbedder
+
+# Short words that do not change what a question asks
+STOP_WORDS = frozenset({
+    'a', 'an', 'am', 'as', 'at', 'be', 'by', 'do', 'i', 'if', 'in', 'is', 'it',
+    'me', 'my', 'of', 'on', 'or', 's', 'so', 't', 'to', 'up', 'us', 'we',
+})
+
+# Words that turn a question into its opposite
+NEGATIONS = frozenset({'not', 'no', 'never', 'without', 'none', 'nothing', 'nobody', 'neither', 'nor'})
+# Contractions are spelled out so "isn't" and "is not" both give 'not'
+CONTRACTIONS = [
+    (re.compile(r"\b(?:can['\u2019]t|cannot)\b"), "can not"),
+    (re.compile(r"\bwon['\u2019]t\b"), "will not"),
+    (re.compile(r"n['\u2019]t\b"), " not"),
+]
+
+
+def exact_tokens(text):
+    """Words a paraphrase must repeat exactly: numbers, negations and other short words
+
+    They barely move the hashed n-gram vector, so "what is 12 times 7" and
+    "what is 12 times 8" embed almost identically; their exact tokens differ.
+    """
+    text = text.lower()
+    for pattern, replacement in CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    return ' '.join(sorted(
+        word for word in WORD_PATTERN.findall(text)
+        if any(c.isdigit() for c in word) or word in NEGATIONS or (len(word) <= 2 and word not in STOP_WORDS)
+    ))
+
+
+class SemanticCache:
+    """Answer cache that also matches paraphrases of earlier questions
+
+    Question vectors live in one preallocated float32 matrix whose row count
+    is capped by both max_entries and max_bytes. Lookups are a single matrix
+    product against all rows, and when the matrix is full the least recently
+    used row is overwritten. Each row is tagged with a scope (the digest of
+    the conversation state) and only rows with the caller's scope can match.
+    Rows also only match questions with the same numbers, negations and
+    short words (exact_tokens), which similarity alone does not tell apart.
+    """
+
+    def __init__(self, embedder=None, threshold=0.9, max_entries=5000, max_bytes=16 * 1024 * 1024):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        row_bytes = self.embedder.dim * np.dtype(np.float32).itemsize
+        self.capacity = max(0, min(max_entries, max_bytes // row_bytes))
+
+        self._vectors = np.zeros((self.capacity, self.embedder.dim), dtype=np.float32)
+        self._scopes = np.zeros(self.capacity, dtype=np.uint32)
+        self._exact = np.zeros(self.capacity, dtype=np.uint32)  # crc32 of each row's exact_tokens
+        self._last_used = np.zeros(self.capacity, dtype=np.int64)  # 0 marks an empty row
+        self._answers = [None] * self.capacity
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _scope_id(scope):
+        return zlib.crc32(scope.encode('utf-8'))
+
+    @staticmethod
+    def _exact_id(question):
+        return zlib.crc32(exact_tokens(question).encode('utf-8'))
+
+    def lookup_batch(self, questions, scope):
+        """Return the best cached answer (or None) for each question"""
+        if not self.capacity or not questions:
+            return [None] * len(questions)
+        queries = self.embedder.embed_batch(questions)
+        scope_id = self._scope_id(scope)
+        exact_ids = np.array([self._exact_id(question) for question in questions], dtype=np.uint32)
+
+        with self._lock:
+            scores = self._vectors @ queries.T  # (capacity, len(questions))
+            usable = (self._last_used > 0) & (self._scopes == scope_id)
+            scores[~(usable[:, None] & (self._exact[:, None] == exact_ids[None, :]))] = -1.0
+            best_rows = scores.argmax(axis=0)
+            best_scores = scores[best_rows, np.arange(len(questions))]
+
+            results = []
+            for row, score in zip(best_rows, best_scores):
+                if score >= self.threshold:
+                    self._clock += 1
+                    self._last_used[row] = self._clock
+                    self.hits += 1
+                    results.append(self._answers[row])
+                else:
+                    self.misses += 1
+                    results.append(None)
+            return results
+
+    def get(self, question, scope):
+        """Return the cached answer for a paraphrase of question, or None"""
+        return self.lookup_batch([question], scope)[0]
+
+    def put(self, question, scope, answer):
+        if not self.capacity:
+            return
+        vector = self.embedder.embed(question)
+        with self._lock:
+            # Empty rows have last_used 0, so they are filled before anything is evicted
+            row = int(self._last_used.argmin())
+            if self._last_used[row] > 0:
+                self.evictions += 1
+            self._clock += 1
+            self._vectors[row] = vector
+            self._scopes[row] = self._scope_id(scope)
+            self._exact[row] = self._exact_id(question)
+            self._last_used[row] = self._clock
+            self._answers[row] = answer
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': int((self._last_used > 0).sum()),
+                'capacity': self.capacity,
+                'matrix_bytes': self._vectors.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
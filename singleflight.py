@@ -0,0 +1,236 @@
+import asyncio
+import threading
+
+
+class Flight:
+    """One outstanding model call and the chunks it has produced so far"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one upstream call
+
+    The first caller for a key (the leader) runs the call; callers that
+    arrive while it is in flight (followers) wait on it and receive the same
+    result. Streaming followers replay the chunks already produced and then
+    receive new ones as the leader reads them. Once a flight finishes its
+    key is released, so later callers start a fresh call (or, more likely,
+    hit the answer cache).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def _publish(self, flight, chunk):
+        with flight.cond:
+            flight.chunks.append(chunk)
+            flight.cond.notify_all()
+
+    def _finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.done = True
+            flight.error = error
+            flight.cond.notify_all()
+
+    def do(self, key, fn):
+        """Return (fn(), shared) where shared is True if another caller ran fn
+
+        fn may return any value; a follower of a streaming flight gets the
+        joined text.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            chunks = list(self._follow(flight))
+            return (chunks[0] if len(chunks) == 1 else ''.join(chunks)), True
+        try:
+            value = fn()
+        except Exception as e:
+            self._finish(key, flight, e)
+            raise
+        self._publish(flight, value)
+        self._finish(key, flight)
+        return value, False
+
+    def stream(self, key, fn):
+        """Return (chunk iterator, shared); fn returns an iterator of text chunks"""
+        flight, leader = self._join(key)
+        if not leader:
+            return self._follow(flight), True
+        return self._lead(key, flight, fn), False
+
+    def _lead(self, key, flight, fn):
+        upstream = None
+        try:
+            upstream = iter(fn())
+            for chunk in upstream:
+                self._publish(flight, chunk)
+                yield chunk
+        except GeneratorExit:
+            # The leader's client went away; finish the call for any followers
+            if flight.followers and upstream is not None:
+                try:
+                    for chunk in upstream:
+                        self._publish(flight, chunk)
+                except Exception as e:
+                    self._finish(key, flight, e)
+                    return
+            self._finish(key, flight, None if flight.followers else RuntimeError("Request was cancelled"))
+            return
+        except Exception as e:
+            self._finish(key, flight, e)
+            raise
+        self._finish(key, flight)
+
+    def _follow(self, flight):
+        index = 0
+        while True:
+            with flight.cond:
+                while index >= len(flight.chunks) and not flight.done:
+                    flight.cond.wait()
+                chunks = flight.chunks[index:]
+                done = flight.done
+                error = flight.error
+            index += len(chunks)
+            yield from chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers,
+            }
+
+
+class AsyncFlight:
+    """A Flight followed by coroutines; changed is set and replaced on every update"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines on one event loop
+
+    Same rules as SingleFlight; fn returns an awaitable (do) or an async
+    iterator of text chunks (stream), and followers await instead of
+    blocking a thread.
+    """
+
+    def _join(self, key):
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.followers += 1
+            self.followers += 1
+            return flight, False
+        flight = AsyncFlight()
+        self._flights[key] = flight
+        self.leaders += 1
+        return flight, True
+
+    def _publish(self, flight, chunk):
+        flight.chunks.append(chunk)
+        flight.notify()
+
+    def _finish(self, key, flight, error=None):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.done = True
+        flight.error = error
+        flight.notify()
+
+    async def do(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            chunks = [chunk async for chunk in self._follow(flight)]
+            return (chunks[0] if len(chunks) == 1 else ''.join(chunks)), True
+        try:
+            value = await fn()
+        except BaseException as e:
+            # Cancelled leaders fail their followers too rather than leave them waiting
+            self._finish(key, flight, e if isinstance(e, Exception) else RuntimeError("Request was cancelled"))
+            raise
+        self._publish(flight, value)
+        self._finish(key, flight)
+        return value, False
+
+    async def _lead(self, key, flight, fn):
+        upstream = None
+        try:
+            upstream = fn()
+            async for chunk in upstream:
+                self._publish(flight, chunk)
+                yield chunk
+        except GeneratorExit:
+            # The leader's client went away; finish the call for any followers
+            if flight.followers and upstream is not None:
+                try:
+                    async for chunk in upstream:
+                        self._publish(flight, chunk)
+                except Exception as e:
+                    self._finish(key, flight, e)
+                    return
+            self._finish(key, flight, None if flight.followers else RuntimeError("Request was cancelled"))
+            return
+        except BaseException as e:
+            self._finish(key, flight, e if isinstance(e, Exception) else RuntimeError("Request was cancelled"))
+            raise
+        self._finish(key, flight)
+
+    async def _follow(self, flight):
+        index = 0
+        while True:
+            if index >= len(flight.chunks) and not flight.done:
+                await flight.changed.wait()
+                continue
+            chunks = flight.chunks[index:]
+            index += len(chunks)
+            for chunk in chunks:
+                yield chunk
+            if flight.done and index >= len(flight.chunks):
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def stats(self):
+        return {
+            'in_flight': len(self._flights),
+            'leaders': self.leaders,
+            'followers': self.followers,
+        }
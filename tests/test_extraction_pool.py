@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction_pool import ExtractionPool, ExtractionTimeout
+
+
+@pytest.fixture
+def pool():
+    pool = ExtractionPool(max_workers=2, timeout=1.5)
+    yield pool
+    if pool._executor is not None:
+        pool._executor.shutdown(cancel_futures=True)
+
+
+def run(pool, seconds):
+    pool._run(f"sleep-{seconds}.pdf", time.sleep, seconds)
+
+
+def test_waiting_behind_other_files_does_not_count_against_the_limit(pool):
+    # Four 1-second files on two workers: the last two wait a second before they start
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        futures = [threads.submit(run, pool, 1.0) for _ in range(4)]
+        for future in futures:
+            future.result()
+    assert pool.timeouts == 0
+
+
+def test_only_the_file_that_runs_over_fails(pool):
+    with ThreadPoolExecutor(max_workers=2) as threads:
+        slow = threads.submit(run, pool, 10)
+        time.sleep(0.2)
+        quick = threads.submit(run, pool, 0.5)
+        with pytest.raises(ExtractionTimeout):
+            slow.result()
+        quick.result()
+    assert pool.timeouts == 1
+    assert pool.crashes == 0
+    # The worker survived its alarm, so the pool was not recreated
+    executor = pool._executor
+    run(pool, 0.1)
+    assert pool._executor is executor
@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import SemanticCache
+
+
+def test_questions_differing_in_a_number_do_not_match():
+    cache = SemanticCache()
+    cache.put("what is 12 times 7", "scope", "84")
+    assert cache.get("what is 12 times 8", "scope") is None
+    assert cache.get("what is 13 times 7", "scope") is None
+
+
+def test_questions_differing_in_a_short_word_do_not_match():
+    cache = SemanticCache()
+    cache.put("what is a pointer in c", "scope", "C answer")
+    assert cache.get("what is a pointer in go", "scope") is None
+
+
+def test_paraphrase_still_matches():
+    cache = SemanticCache()
+    cache.put("what is 12 times 7", "scope", "84")
+    assert cache.get("What is 12 times 7?", "scope") == "84"
+    assert cache.get("so what is 12 times 7", "scope") == "84"
+
+
+def test_other_scope_does_not_match():
+    cache = SemanticCache()
+    cache.put("what is recursion", "scope", "answer")
+    assert cache.get("what is recursion", "other") is None
+
+
+def test_negated_questions_do_not_match():
+    cache = SemanticCache()
+    cache.put("why is recursion useful", "scope", "Because...")
+    cache.put("what is a linked list", "scope", "A list of nodes")
+    assert cache.get("why is recursion not useful", "scope") is None
+    assert cache.get("why isn't recursion useful", "scope") is None
+    assert cache.get("what is not a linked list", "scope") is None
+
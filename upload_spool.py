@@ -0,0 +1,144 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+
+SNIFF_BYTES = 512
+
+# Extensions and the kinds of content they may contain
+EXPECTED_KINDS = {
+    'txt': {'text'},
+    'pdf': {'pdf'},
+    'docx': {'zip'},
+    'doc': {'zip', 'ole'},
+}
+
+
+def sniff(head):
+    """Guess what kind of file starts with head"""
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return 'zip'
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'ole'
+    if b'\x00' in head:
+        return 'binary'
+    # The head may end part-way through a multi-byte character
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            return 'binary'
+    return 'text'
+
+
+def kind_matches(kind, extension):
+    """True if content of this kind fits the file extension"""
+    return kind in EXPECTED_KINDS.get(extension, ())
+
+
+def sniff_file(path):
+    """Guess what kind of file is at path from its first bytes"""
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    return sniff(head) if head else 'empty'
+
+
+class UploadSpool:
+    """Writable file an upload is streamed into, chunk by chunk
+
+    Every chunk written is hashed and counted as it passes, and the first
+    bytes are kept for sniffing the file type, so the upload never has to
+    be held in memory. The file stays on disk until close(delete=True) or
+    until it is moved elsewhere with detach().
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='upload-', suffix='.part', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    @classmethod
+    def from_file(cls, path):
+        """Adopt a file that is already on disk, hashing it CHUNK_SIZE bytes at a time"""
+        spool = cls.__new__(cls)
+        spool.path = path
+        spool._file = open(path, 'r+b')
+        spool._hash = hashlib.sha256()
+        spool.size = 0
+        spool.head = b''
+        for chunk in iter(lambda: spool._file.read(cls.CHUNK_SIZE), b''):
+            spool._observe(chunk)
+        spool._file.seek(0)
+        return spool
+
+    @classmethod
+    def copy_from(cls, stream, directory):
+        """Spool a readable stream, CHUNK_SIZE bytes at a time"""
+        spool = cls(directory)
+        for chunk in iter(lambda: stream.read(cls.CHUNK_SIZE), b''):
+            spool.write(chunk)
+        spool.seek(0)
+        return spool
+
+    def _observe(self, data):
+        if len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+        self._hash.update(data)
+        self.size += len(data)
+
+    def write(self, data):
+        self._observe(data)
+        return self._file.write(data)
+
+    @property
+    def content_hash(self):
+        return self._hash.hexdigest()
+
+    @property
+    def kind(self):
+        return sniff(self.head) if self.size else 'empty'
+
+    def matches(self, extension):
+        """True if the sniffed content fits the file extension"""
+        return kind_matches(self.kind, extension)
+
+    def detach(self):
+        """Flush and close the file but keep it on disk; returns its path"""
+        self._file.close()
+        path, self.path = self.path, None
+        return path
+
+    def close(self, delete=True):
+        if not self._file.closed:
+            self._file.close()
+        if delete and self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __getattr__(self, name):
+        # read, seek, tell, readline... go to the underlying file
+        return getattr(self._file, name)
+
+
+class SpoolingRequest(Request):
+    """Request that streams uploaded files into UploadSpools
+
+    Werkzeug's form parser writes each file part into the stream returned
+    here as the body arrives, so the upload is hashed and written to disk
+    without ever being read into memory whole. The spool directory is
+    taken from the SPOOL_FOLDER app setting.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(current_app.config['SPOOL_FOLDER'])
@@ -0,0 +1,206 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class UploadStorage:
+    """Dict-like store for uploaded files with a memory budget
+
+    Entries are kept in least recently used order. Each entry's size is
+    measured with sizeof when it is stored, and once the total passes
+    max_bytes the least recently used entries are evicted. An entry that
+    has not been read for its ttl (seconds) expires; a background janitor
+    removes expired entries every janitor_interval seconds so idle workers
+    give the memory back too.
+
+    Entries can also be shared: acquire records an owner (a conversation)
+    for a key and release removes it, dropping the entry as soon as its
+    last owner lets go.
+
+    on_remove(key, value) is called, outside the lock, for every entry that
+    is evicted, expires, is released or deleted, so resources held outside
+    the heap (e.g. spilled files) can be cleaned up.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=60 * 60, sizeof=None, janitor_interval=60, on_remove=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or sys.getsizeof
+        self.on_remove = on_remove
+        self._removed = []  # (key, value) pairs waiting for on_remove
+        self._entries = OrderedDict()  # key -> [value, size, expires_at, ttl]
+        self._owners = {}  # key -> set of owners sharing the entry
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._stop = threading.Event()
+        if janitor_interval:
+            self._janitor = threading.Thread(
+                target=self._janitor_loop, args=(janitor_interval,), name='upload-janitor', daemon=True
+            )
+            self._janitor.start()
+
+    def _janitor_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.remove_expired()
+
+    def close(self):
+        """Stop the janitor thread"""
+        self._stop.set()
+
+    def _drop(self, key):
+        value, size, expires_at, ttl = self._entries.pop(key)
+        self._owners.pop(key, None)
+        self._total_bytes -= size
+        if self.on_remove is not None:
+            self._removed.append((key, value))
+
+    def _notify_removed(self):
+        """Run on_remove for entries dropped while the lock was held"""
+        if not self._removed:
+            return
+        with self._lock:
+            removed, self._removed = self._removed, []
+        for key, value in removed:
+            try:
+                self.on_remove(key, value)
+            except Exception as e:
+                print(f"Error removing upload {key}: {str(e)}")
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def put(self, key, value, ttl=None):
+        """Store value under key; ttl overrides the default expiry for this entry"""
+        size = self.sizeof(value)
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = [value, size, time.monotonic() + ttl, ttl]
+            self._total_bytes += size
+            # Evict least recently used entries, but never the one just stored
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        self._notify_removed()
+
+    def resize(self, key):
+        """Measure an entry again after it grew in place; returns False if it is gone"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            size = self.sizeof(entry[0])
+            self._total_bytes += size - entry[1]
+            entry[1] = size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                if oldest == key:
+                    # Evict around the entry that grew, not the entry itself
+                    self._entries.move_to_end(key)
+                    oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+        self._notify_removed()
+        return True
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                # Reading an entry marks it recently used and restarts its ttl
+                self._entries.move_to_end(key)
+                entry[2] = time.monotonic() + entry[3]
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        self._notify_removed()
+        return default
+
+    def acquire(self, key, owner):
+        """Record owner as sharing the entry under key; returns False if it is gone"""
+        with self._lock:
+            live = self._live_entry(key) is not None
+            if live:
+                self._owners.setdefault(key, set()).add(owner)
+        self._notify_removed()
+        return live
+
+    def release(self, key, owner):
+        """Remove owner from the entry under key, dropping it once nobody owns it"""
+        with self._lock:
+            owners = self._owners.get(key)
+            if owners is None:
+                return
+            owners.discard(owner)
+            if not owners and key in self._entries:
+                self._drop(key)
+        self._notify_removed()
+
+    def remove_expired(self):
+        """Drop every expired entry and return how many were removed"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+            for key in expired:
+                self._drop(key)
+            self.expirations += len(expired)
+        self._notify_removed()
+        return len(expired)
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self._drop(key)
+        self._notify_removed()
+
+    def __contains__(self, key):
+        with self._lock:
+            live = self._live_entry(key) is not None
+        self._notify_removed()
+        return live
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'owners': sum(len(owners) for owners in self._owners.values()),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
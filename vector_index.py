@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+
+
+class VectorIndex:
+    """Dense passage vectors in one contiguous matrix with top-k search
+
+    Rows are L2-normalized embeddings, so a matrix-vector product gives the
+    cosine similarity of every passage at once and argpartition picks the
+    top k without sorting the rest. With quantize=True rows are stored as
+    int8 with one float32 scale per row, a quarter of the memory.
+    """
+
+    def __init__(self, vectors, scales=None):
+        self.vectors = vectors
+        self.scales = scales
+
+    @classmethod
+    def build(cls, embedder, texts, quantize=False):
+        vectors = np.ascontiguousarray(embedder.embed_batch(texts), dtype=np.float32)
+        if not quantize:
+            return cls(vectors)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return cls(quantized, scales.astype(np.float32))
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def nbytes(self):
+        """Heap memory held by the index; a memory-mapped matrix lives in the page cache"""
+        vector_bytes = 0 if isinstance(self.vectors, np.memmap) else self.vectors.nbytes
+        return vector_bytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query_vector):
+        if self.scales is None:
+            return self.vectors @ query_vector
+        return (self.vectors @ query_vector) * self.scales
+
+    def search(self, query_vector, k=8):
+        """Return up to k (score, row) pairs, best first"""
+        count = len(self)
+        if not count:
+            return []
+        scores = self.scores(query_vector)
+        k = min(k, count)
+        if k < count:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), int(row)) for row in top]
+
+    def save(self, path):
+        """Write the matrix (and scales) as .npy files next to path"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, self.vectors)
+        os.replace(tmp_path, f"{path}.npy")
+        if self.scales is not None:
+            np.save(tmp_path, self.scales)
+            os.replace(tmp_path, f"{path}.scales.npy")
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a saved index, memory-mapping the matrix by default"""
+        mode = 'r' if mmap else None
+        vectors = np.load(f"{path}.npy", mmap_mode=mode)
+        scales = None
+        if vectors.dtype == np.int8:
+            scales = np.load(f"{path}.scales.npy")
+        return cls(vectors, scales)
+
+    @classmethod
+    def load_or_build(cls, cache_dir, key, embedder, texts, quantize=False):
+        """Load the index saved under key, or embed texts and save it
+
+        key must identify both the document content and how it was chunked
+        and embedded, so a re-upload or restart reuses the saved vectors.
+        """
+        path = os.path.join(cache_dir, key)
+        if os.path.exists(f"{path}.npy"):
+            try:
+                index = cls.load(path)
+                if len(index) == len(texts) and (index.scales is not None) == quantize:
+                    return index
+            except Exception as e:
+                print(f"Error loading vector index {path}: {str(e)}")
+        index = cls.build(embedder, texts, quantize=quantize)
+        try:
+            index.save(path)
+        except Exception as e:
+            print(f"Error saving vector index {path}: {str(e)}")
+        return index